@@ -0,0 +1,245 @@
+import argparse
+import atexit
+import logging
+import shutil
+import tempfile
+from util.async_logger import get_log_stats, setup_logger
+# log to a throwaway directory, removed after the log listener has stopped
+log_dir = tempfile.mkdtemp(prefix='ring_benchmark_')
+atexit.register(shutil.rmtree, log_dir, True)
+log = setup_logger('ring_automation', log_dir=log_dir, level=logging.INFO, console=False)
+import asyncio
+import gc
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+from ring.fakering import FakeRing
+from ring.lightcontroller import LightController
+from ring.ringeventhandler import RingEventHandler
+from ring_doorbell import RingEvent, RingEventKind
+
+# micro-benchmarks for the hot paths against a FakeRing with no latency, e.g.
+#   python src/benchmark.py --save-baseline bench.json
+#   python src/benchmark.py --baseline bench.json --tolerance 0.25
+# prints json results, and exits 1 if anything is slower than the baseline by more than the tolerance
+# or by more than the two runs' own measured noise allows, whichever is bigger
+
+# everything but the logging benchmarks runs with the logger at this level, so they time the
+# code rather than the log file and the queue listener thread competing with it
+BENCH_LOG_LEVEL = logging.WARNING
+
+DEVICE_ID = 1
+DEVICE_NAME = 'Drive'
+FOREIGN_DEVICE_ID = 2
+# how many times its noise (see noise()) a result can move before it counts as a regression
+NOISE_FACTOR = 3.0
+# reference loop iterations per benchmark operation, roughly the cost of an on_event
+REFERENCE_SCALE = 20
+
+def make_ring() -> FakeRing:
+    # light already on so set_lights never has to go to the (fake) API
+    ring = FakeRing({DEVICE_ID: DEVICE_NAME}, latency=0.0, lag=0.0)
+    for data in (ring._backend, ring.devices_data):
+        data['stickup_cams'][DEVICE_ID]['led_status'] = 'on'
+    return ring
+
+def make_light(ring: FakeRing, timezone: str) -> LightController:
+    lc = LightController(ring, DEVICE_NAME, timezone)
+    lc.is_dark = lambda: True
+    return lc
+
+def make_events(kind: str, count: int) -> list[RingEvent]:
+    now = time.time()
+    events = []
+    for i in range(count):
+        events.append(RingEvent(
+            id=0 if kind == 'duplicate' else i,
+            doorbot_id=FOREIGN_DEVICE_ID if kind == 'foreign' else DEVICE_ID,
+            device_name=DEVICE_NAME,
+            device_kind='cocoa_floodlight',
+            now=now - 60 if kind == 'old' else now,
+            expires_in=180,
+            kind=RingEventKind.MOTION.value,
+            state='human',
+            is_update=kind == 'duplicate',
+        ))
+    return events
+
+async def bench_on_event(kind: str, count: int, timezone: str) -> float:
+    # on_event through to the per-device worker having processed it and the light task done
+    ring = make_ring()
+    lc = make_light(ring, timezone)
+    handler = RingEventHandler(ring, {DEVICE_ID: lc}, queue_size=count + 1)
+    await handler.start()
+    if kind == 'duplicate':
+        handler.processed_events.add(0, time.time() + 180)
+    events = make_events(kind, count)
+
+    start = time.perf_counter()
+    for event in events:
+        handler.on_event(event)
+    await asyncio.gather(*(queue.join() for queue in handler._queues.values()))
+    await asyncio.gather(*handler._light_tasks)
+    elapsed = time.perf_counter() - start
+
+    await handler.stop()
+    lc.close()
+    return elapsed
+
+async def bench_is_dark(count: int, timezone: str) -> float:
+    lc = LightController(make_ring(), DEVICE_NAME, timezone)
+    start = time.perf_counter()
+    for _ in range(count):
+        lc.is_dark()
+    return time.perf_counter() - start
+
+async def bench_set_lights(count: int, timezone: str) -> float:
+    # light already on: the dark check, pushing the off deadline and deciding there's nothing to send
+    lc = make_light(make_ring(), timezone)
+    start = time.perf_counter()
+    for _ in range(count):
+        await lc.set_lights(True, 30)
+    elapsed = time.perf_counter() - start
+    lc.close()
+    return elapsed
+
+async def bench_log(level: int, count: int, timezone: str) -> float:
+    # a module logger created after setup_logger is an AsyncLoggerAdapter, so this is the
+    # per-message cost a debug line in ring_doorbell etc. pays at each level
+    adapter = logging.getLogger('ring_automation_benchmark.adapter')
+    previous = log.level
+    log.setLevel(level)
+    start = time.perf_counter()
+    for i in range(count):
+        adapter.debug("benchmark::bench_log: message [%s] of [%s]", i, count)
+    elapsed = time.perf_counter() - start
+    log.setLevel(previous)
+    # let the listener thread drain what this run queued so the next run isn't competing with it
+    while get_log_stats().get('queued'):
+        await asyncio.sleep(0.01)
+    return elapsed
+
+BENCHMARKS = {
+    'on_event_new': lambda count, tz: bench_on_event('new', count, tz),
+    'on_event_duplicate': lambda count, tz: bench_on_event('duplicate', count, tz),
+    'on_event_old': lambda count, tz: bench_on_event('old', count, tz),
+    'on_event_foreign': lambda count, tz: bench_on_event('foreign', count, tz),
+    'is_dark': bench_is_dark,
+    'set_lights_already_on': bench_set_lights,
+    'log_debug_at_debug': lambda count, tz: bench_log(logging.DEBUG, count, tz),
+    'log_debug_at_info': lambda count, tz: bench_log(logging.INFO, count, tz),
+}
+
+def noise(samples: list[float]) -> float:
+    # interquartile range relative to the median, shrunk by sqrt(n) as that's how much less the
+    # median of n samples moves between runs than one sample does
+    if len(samples) < 4:
+        return 0.0
+    q1, _, q3 = statistics.quantiles(samples, n=4)
+    return (q3 - q1) / statistics.median(samples) / math.sqrt(len(samples))
+
+async def time_bench(bench, count: int, timezone: str) -> float:
+    # collect first and keep gc out of the timed part, a collection landing in one run and
+    # not the next was a good part of the noise
+    gc.collect()
+    gc.disable()
+    try:
+        return await bench(count, timezone)
+    finally:
+        gc.enable()
+
+async def bench_reference(count: int, timezone: str) -> float:
+    # fixed pure python work that never changes, to measure how fast the machine is right now
+    start = time.perf_counter()
+    d = dict()
+    for i in range(count * REFERENCE_SCALE):
+        d[i & 1023] = d.get(i & 1023, 0) + i
+    return time.perf_counter() - start
+
+async def run(args) -> dict:
+    names = [name for name in BENCHMARKS if not args.only or name in args.only]
+    log.setLevel(BENCH_LOG_LEVEL)
+    # one untimed run each to warm caches (solar schedule, logger, etc)
+    for name in names:
+        await time_bench(BENCHMARKS[name], args.count, args.timezone)
+
+    # rounds go through every benchmark in turn next to the reference, so a slow patch on a
+    # shared machine hits a round rather than one benchmark, and dividing by that round's
+    # reference time takes most of it out again
+    timings = {name: [] for name in names}
+    relative = {name: [] for name in names}
+    for _ in range(args.repeat):
+        reference = await time_bench(bench_reference, args.count, args.timezone)
+        for name in names:
+            elapsed = await time_bench(BENCHMARKS[name], args.count, args.timezone)
+            timings[name].append(elapsed)
+            relative[name].append(elapsed / reference)
+
+    results = dict()
+    for name in names:
+        median = statistics.median(timings[name])
+        results[name] = {
+            'ns_per_op': round(median / args.count * 1e9, 1),
+            'ops_per_s': round(args.count / median) if median else None,
+            # cost relative to the reference, what's compared against a baseline
+            'relative': round(statistics.median(relative[name]), 4),
+            'noise': round(noise(relative[name]), 3),
+        }
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[dict]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        # relative to the reference so a slower or busier machine doesn't read as a regression
+        key = 'relative' if 'relative' in base else 'ns_per_op'
+        ratio = result[key] / base[key] if base[key] else 1.0
+        result['vs_baseline'] = round(ratio, 3)
+        # a benchmark that moves around a lot between runs gets more room than the tolerance,
+        # from the noise measured in both the baseline and this run
+        allowed = max(tolerance, NOISE_FACTOR * math.hypot(base.get('noise', 0.0), result['noise']))
+        result['allowed'] = round(allowed, 3)
+        if ratio > 1 + allowed:
+            regressions.append({'benchmark': name, 'baseline_ns': base['ns_per_op'], 'ns': result['ns_per_op'],
+                                'ratio': round(ratio, 3), 'allowed': round(allowed, 3)})
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the event handling hot paths against a fake Ring backend')
+    parser.add_argument('--count', type=int, default=10000, help='operations per run (default 10000)')
+    parser.add_argument('--repeat', type=int, default=9, help='runs per benchmark, the median is kept (default 9)')
+    parser.add_argument('--only', nargs='*', choices=list(BENCHMARKS), help='benchmarks to run, default all')
+    parser.add_argument('--timezone', default='Europe/London')
+    parser.add_argument('--baseline', help='json results from an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown vs the baseline, 0.25 = 25%%')
+    parser.add_argument('--save-baseline', help='write these results to this file')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.count < 1 or args.repeat < 1:
+        raise SystemExit("benchmark: --count and --repeat must be >= 1")
+
+    output = {
+        'python': platform.python_version(),
+        'count': args.count,
+        'repeat': args.repeat,
+        'results': asyncio.run(run(args)),
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(output['results'], json.load(f), args.tolerance)
+        output['tolerance'] = args.tolerance
+        output['regressions'] = regressions
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+
+    print(json.dumps(output, indent=2))
+    sys.exit(1 if regressions else 0)
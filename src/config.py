@@ -2,14 +2,38 @@ import json
 from pathlib import Path
 
 class Config:
-    def __init__(self, config_path=None):
+    def __init__(self, config_path=None, account: str = None):
         if config_path is None:
             # Find project root (where config.json lives)
             project_root = Path(__file__).parent
             config_path = project_root / 'config.json'
 
-        with open(config_path, 'r') as f:
-            self._config = json.load(f)
+        self.config_path = Path(config_path)
+        # with an account name this is that account's view of the file, see _load
+        self.account = account
+        self._config = self._load()
+
+    def _load(self) -> dict:
+        with open(self.config_path, 'r') as f:
+            config = json.load(f)
+        if self.account is None:
+            return config
+        # an entry in 'accounts' overrides the top level settings for that account
+        accounts = {entry['name']: entry for entry in config.get('accounts', [])}
+        if self.account not in accounts:
+            raise KeyError(f"account [{self.account}] not in [{self.config_path}]")
+        merged = {key: value for key, value in config.items() if key != 'accounts'}
+        merged.update(accounts[self.account])
+        return merged
+
+    def reload(self) -> bool:
+        # re-read config.json in place, returns True if anything changed. raises if the
+        # file doesn't parse, leaving the current settings alone
+        new_config = self._load()
+        if new_config == self._config:
+            return False
+        self._config = new_config
+        return True
 
     def get(self, *keys):
         value = self._config
@@ -17,6 +41,11 @@ class Config:
             value = value[key]
         return value
     
+    @property
+    def config_reload_interval(self) -> float:
+        # seconds between checks for edits to this file while running, 0 to not watch
+        return self._config.get('config_reload_interval', 2.0)
+
     @property
     def log_dir(self):
         return self._config['logger']['directory']
@@ -28,6 +57,19 @@ class Config:
     @property
     def log_stderr(self) -> bool:
         return self._config.get('logger', {}).get('stderr', False)
+
+    @property
+    def log_queue_size(self) -> int:
+        return self._config.get('logger', {}).get('queue_size', 10000)
+
+    @property
+    def log_overflow(self) -> str:
+        # 'drop_oldest' or 'sample'
+        return self._config.get('logger', {}).get('overflow', 'drop_oldest')
+
+    @property
+    def log_json(self) -> bool:
+        return self._config.get('logger', {}).get('format', 'text') == 'jsonl'
     
     @property
     def get_timezone(self) -> str:
@@ -36,5 +78,118 @@ class Config:
     @property
     def get_light_devices(self) -> list[str]:
         return self._config.get('lights')
+
+    @property
+    def get_light_groups(self) -> list[dict]:
+        # [{"name": ..., "triggers": [camera names], "lights": [light names], "duration": seconds}]
+        return self._config.get('groups', [])
+
+    @property
+    def get_confirm_mode(self) -> str:
+        return self._config.get('confirm_mode', 'poll')
+
+    @property
+    def get_refresh_max_age(self) -> float:
+        return self._config.get('refresh_max_age', 2.0)
+
+    @property
+    def get_rate_limit(self) -> float:
+        # Ring API requests per second, shared by every light
+        return self._config.get('rate_limit', {}).get('rate', 2.0)
+
+    @property
+    def get_rate_burst(self) -> int:
+        return self._config.get('rate_limit', {}).get('burst', 5)
+
+    @property
+    def get_event_queue_size(self) -> int:
+        return self._config.get('event_queue', {}).get('size', 100)
+
+    @property
+    def get_event_queue_overflow(self) -> str:
+        return self._config.get('event_queue', {}).get('overflow', 'drop_oldest')
+
+    @property
+    def catch_up_window(self) -> float:
+        # seconds after the listener starts to collapse the sign-in flood of events, 0 to not
+        return self._config.get('event_queue', {}).get('catch_up_window', 3.0)
+
+    @property
+    def record_file(self) -> str:
+        # path to append a jsonl capture of every incoming event to, None to not record
+        return self._config.get('record_file')
+
+    @property
+    def state_snapshot_interval(self) -> float:
+        # seconds between runtime state snapshots, 0 to not save or restore state
+        return self._config.get('state_snapshot_interval', 5.0)
+
+    @property
+    def keep_warm_enabled(self) -> bool:
+        # token refresh and connection keepalive while it's dark, see ring/keepwarm.py. off by
+        # default as it adds a Ring API call every interval all night
+        return self._config.get('keep_warm', {}).get('enabled', False)
+
+    @property
+    def keep_warm_interval(self) -> float:
+        return self._config.get('keep_warm', {}).get('interval', 45.0)
+
+    @property
+    def keep_warm_refresh_margin(self) -> float:
+        # refresh the token when it has less than this many seconds left
+        return self._config.get('keep_warm', {}).get('refresh_margin', 600.0)
+
+    @property
+    def diagnostics_enabled(self) -> bool:
+        # loop lag / slow callback monitor, see util/loopmonitor.py
+        return self._config.get('diagnostics', {}).get('enabled', False)
+
+    @property
+    def diagnostics_lag_interval(self) -> float:
+        return self._config.get('diagnostics', {}).get('lag_interval', 0.5)
+
+    @property
+    def diagnostics_slow_callback(self) -> float:
+        return self._config.get('diagnostics', {}).get('slow_callback', 0.1)
+
+    @property
+    def diagnostics_report_interval(self) -> float:
+        return self._config.get('diagnostics', {}).get('report_interval', 60.0)
+
+    @property
+    def accounts(self) -> list[str]:
+        # names of the accounts supervisor.py runs, each {"name": ..., "user_agent": ..., <overrides>}
+        return [entry['name'] for entry in self._config.get('accounts', [])]
+
+    @property
+    def user_agent(self) -> str:
+        # per account, keeps each account's token/gcm/state cache files apart. None for the default
+        return self._config.get('user_agent')
+
+    @property
+    def supervisor_mode(self) -> str:
+        # 'tasks' runs every account on one loop, 'processes' one worker process per account
+        return self._config.get('supervisor', {}).get('mode', 'tasks')
+
+    @property
+    def supervisor_health_interval(self) -> float:
+        return self._config.get('supervisor', {}).get('health_interval', 30.0)
+
+    @property
+    def supervisor_restart_delay(self) -> float:
+        # first wait before restarting a failed account, doubles up to 5 minutes
+        return self._config.get('supervisor', {}).get('restart_delay', 5.0)
+
+    @property
+    def metrics_enabled(self) -> bool:
+        return self._config.get('metrics', {}).get('enabled', False)
+
+    @property
+    def metrics_host(self) -> str:
+        return self._config.get('metrics', {}).get('host', '127.0.0.1')
+
+    @property
+    def metrics_port(self) -> int:
+        return self._config.get('metrics', {}).get('port', 9101)
     
 config = Config()
@@ -1,67 +1,124 @@
 import logging
-from util.async_logger import setup_logger
+from config import Config
+from util.async_logger import get_log_stats, setup_logger
+config = Config()
 # intercept any other logging stuff
-log = setup_logger('ring_automation', level=logging.DEBUG)
+log = setup_logger('ring_automation', level=logging.DEBUG, queue_size=config.log_queue_size,
+                   overflow=config.log_overflow, json_format=config.log_json)
 logging.getLogger('ring_doorbell.listen.eventlistener').setLevel(logging.DEBUG)
 logging.getLogger('firebase_messaging.fcmpushclient').setLevel(logging.DEBUG)
 import asyncio
 import getpass
-import json
-from config import Config
+import time
 from pathlib import Path
 from ring_doorbell import Auth, AuthenticationError, Requires2FAError, Ring, RingEventListener
+from ring.devicerefresher import get_refresher
+from ring.deviceinventory import load_inventory, snapshot_inventory, write_inventory
+from ring.eventrecorder import EventRecorder
+from ring.keepwarm import KeepWarm, create_http_session
 from ring.lightcontroller import LightController
-from ring.ringeventhandler import RingEventHandler
+from ring.lightgroup import LightGroup
+from ring.offscheduler import get_off_scheduler
+from ring.ratelimiter import PRIORITY_REFRESH, get_rate_limiter
+from ring.ringeventhandler import DEFAULT_LIGHT_DURATION, RingEventHandler
+from ring.runtimestate import StateSaver, load_state, restore_state
+from util.configwatcher import ConfigWatcher
+from util.credentialstore import CredentialStore
+from util.loopmonitor import LoopMonitor
+from util.metrics import MetricsServer, registry
 from ring_doorbell.const import USER_AGENT
 # can change this in future
 user_agent = USER_AGENT
-cache_file = Path(user_agent + ".token.cache")
-gcm_cache_file = Path(user_agent + ".gcm.cache")
+start_time = time.monotonic()
+
+class Account:
+    # everything that's per Ring account: its view of config.json, cache files and credential
+    # stores. main runs the one default account, supervisor.py one per entry in 'accounts'
+    def __init__(self, account_config: Config, name: str = 'default', user_agent: str = USER_AGENT, standalone: bool = True):
+        self.name = name
+        self.config = account_config
+        self.user_agent = user_agent
+        self.cache_file = Path(user_agent + ".token.cache")
+        # the gcm cache has always had a different name for a non default user agent
+        self.gcm_cache_file = Path(user_agent + (".gcm.cache" if user_agent == USER_AGENT else ".gcm_token.cache"))
+        self.inventory_file = Path(user_agent + ".devices.cache")
+        self.state_file = Path(user_agent + ".state.cache")
+        # tokens live in memory and are written off the loop, see CredentialStore
+        self.token_store = CredentialStore(self.cache_file)
+        self.gcm_store = CredentialStore(self.gcm_cache_file)
+        # the account's own aiohttp session with a longer keepalive, see ring/keepwarm.py
+        self.http_session = None
+        # standalone runs its own metrics server and loop monitor and waits for enter on stdin.
+        # under the supervisor those are shared, and stop_event ends listen()
+        self.standalone = standalone
+        self.stop_event = None
+
+        # monotonic time the current run_account started, for time to listen
+        self.start_time = None
+
+        # for health(), filled in by listen()
+        self.state = 'created'
+        self.error = None
+        self.lc_dict = dict()
+        self.event_handler = None
+
+    def token_updated(self, token) -> None:
+        self.token_store.update(token)
+
+    def credentials_updated_callback(self, new_creds) -> None:
+        log.debug("main::credentials_updated_callback: [%s] new creds [%s]", self.name, new_creds)
+        self.gcm_store.update(new_creds)
+        log.info("main::credentials_updated_callback: [%s] GCM credentials updated, saving", self.name)
+
+    def health(self) -> dict:
+        health = {
+            'account': self.name,
+            'state': self.state,
+            'lights': len(self.lc_dict),
+            'lights_on': sum(1 for lc in self.lc_dict.values() if lc.is_on),
+        }
+        if self.event_handler:
+            health['events'] = self.event_handler.enqueued
+            health['dropped'] = self.event_handler.dropped
+        if self.error:
+            health['error'] = self.error
+        return health
 
 def log_debug_info(event_listener: RingEventListener) -> None:
     PREFIX = "main::log_debug_info: "
     if event_listener.subscribed:
-        log.debug(f"{PREFIX} Listener subscribed")
+        log.debug("%s Listener subscribed", PREFIX)
 
-        log.debug(f"{PREFIX} Listener started: {event_listener.started}")
-        log.debug(f"{PREFIX} Listener subscribed: {event_listener.subscribed}")
+        log.debug("%s Listener started: %s", PREFIX, event_listener.started)
+        log.debug("%s Listener subscribed: %s", PREFIX, event_listener.subscribed)
 
         # Check for subscription-related attributes
         if hasattr(event_listener, '_subscriptions'):
-            log.debug(f"{PREFIX} Listener _subscriptions: {event_listener._subscriptions}")
+            log.debug("%s Listener _subscriptions: %s", PREFIX, event_listener._subscriptions)
         if hasattr(event_listener, '_subscription_counter'):
-            log.debug(f"{PREFIX} Subscription counter: {event_listener._subscription_counter}")
+            log.debug("%s Subscription counter: %s", PREFIX, event_listener._subscription_counter)
 
         # Check the receiver's state
         if hasattr(event_listener, '_receiver') and event_listener._receiver:
             receiver = event_listener._receiver
-            log.debug(f"{PREFIX} Receiver type: {type(receiver)}")
+            log.debug("%s Receiver type: %s", PREFIX, type(receiver))
             if hasattr(receiver, '_callbacks'):
-                log.debug(f"{PREFIX} Receiver callbacks count: {len(receiver._callbacks)}")
-                log.debug(f"{PREFIX} Receiver callbacks: {receiver._callbacks}")
-
-def token_updated(token) -> None:
-    cache_file.write_text(json.dumps(token))
+                log.debug("%s Receiver callbacks count: %s", PREFIX, len(receiver._callbacks))
+                log.debug("%s Receiver callbacks: %s", PREFIX, receiver._callbacks)
 
 def otp_callback():
     return input("2FA code: ")
 
-def credentials_updated_callback(new_creds) -> None:
-    log.debug(f"main::credentials_updated_callback: new creds [{new_creds}]")
-    with open(gcm_cache_file, "w", encoding="utf-8") as f:
-        json.dump(new_creds, f)
-    log.info("main::credentials_updated_callback: GCM credentials updated and saved")
-
 ####
 # this and _get_ring are copied from ring_doorbell.cli
-async def _do_auth(username, password, user_agent=USER_AGENT):
+async def _do_auth(username, password, user_agent=USER_AGENT, token_updated=None, http_session=None):
     if not username:
         username = input("Username: ")
 
     if not password:
         password = getpass.getpass("Password: ")
 
-    auth = Auth(user_agent, None, token_updated)
+    auth = Auth(user_agent, None, token_updated, http_client_session=http_session)
     try:
         await auth.async_fetch_token(username, password)
         return auth
@@ -69,17 +126,17 @@ async def _do_auth(username, password, user_agent=USER_AGENT):
         await auth.async_fetch_token(username, password, input("2FA Code: "))
         return auth
 
-async def _get_ring(username, password, do_update_data, user_agent=USER_AGENT):
+async def _get_ring(username, password, do_update_data, account: Account):
     # connect to Ring account
-    global cache_file, gcm_cache_file
-    if user_agent != USER_AGENT:
-        cache_file = Path(user_agent + ".token.cache")
-        gcm_cache_file = Path(user_agent + ".gcm_token.cache")
-    if cache_file.is_file():
+    user_agent = account.user_agent
+    token_updated = account.token_updated
+    http_session = account.http_session
+    if account.token_store.exists():
         auth = Auth(
             user_agent,
-            json.loads(cache_file.read_text(encoding="utf-8")),
+            account.token_store.load(),
             token_updated,
+            http_client_session=http_session,
         )
         ring = Ring(auth)
         do_method = (
@@ -88,14 +145,14 @@ async def _get_ring(username, password, do_update_data, user_agent=USER_AGENT):
         try:
             await do_method()
         except AuthenticationError:
-            auth = await _do_auth(username, password)
+            auth = await _do_auth(username, password, user_agent, token_updated, http_session)
             ring = Ring(auth)
             do_method = (
                 ring.async_update_data if do_update_data else ring.async_create_session
             )
             await do_method()
     else:
-        auth = await _do_auth(username, password, user_agent=user_agent)
+        auth = await _do_auth(username, password, user_agent=user_agent, token_updated=token_updated, http_session=http_session)
         ring = Ring(auth)
         do_method = (
             ring.async_update_data if do_update_data else ring.async_create_session
@@ -105,66 +162,237 @@ async def _get_ring(username, password, do_update_data, user_agent=USER_AGENT):
     return ring
 ####
 
-async def listen(ring: Ring) -> None:
+async def refresh_ring_data(ring: Ring, refresher) -> None:
+    # what ring.async_update_data() does, but through the shared refresher and with
+    # dings and groups fetched side by side
+    await refresher.refresh()
+    limiter = get_rate_limiter(ring)
+    await asyncio.gather(limiter.call(PRIORITY_REFRESH, ring.async_update_dings), limiter.call(PRIORITY_REFRESH, ring.async_update_groups))
+
+def sync_light_controllers(ring: Ring, lc_dict: dict, groups: dict, config: Config) -> None:
+    # create, drop or resync LightControllers (and rebuild the light groups) to match the
+    # configured lights and ring's current devices_data
+    # ring caches its RingDevices on first use, clear it so it's rebuilt from the latest devices_data
+    ring._devices = None
+    timezone = config.get_timezone
+    confirm_mode = config.get_confirm_mode
+
+    # every light in a group gets a LightController too, even if it's not in 'lights'
+    light_names = list(config.get_light_devices)
+    for group_config in config.get_light_groups:
+        light_names.extend(name for name in group_config['lights'] if name not in light_names)
+
+    wanted = dict()
+    for device_name in light_names:
+        ring_device = ring.get_device_by_name(device_name)
+
+        if not ring_device:
+            log.error("main::sync_light_controllers: configured light device [%s] not found at Ring, skipping", device_name)
+            continue
+        # ring_device.id is the id we get on the RingEvents as 'doorbot_id', confusingly
+        wanted[ring_device.id] = device_name
+
+    for device_id in list(lc_dict):
+        if device_id not in wanted:
+            log.info("main::sync_light_controllers: removing LightController for [%s]", lc_dict[device_id].device_name)
+            lc_dict.pop(device_id).close()
+
+    for device_id, device_name in wanted.items():
+        if device_id in lc_dict:
+            lc_dict[device_id].reconfigure(timezone, confirm_mode)
+            lc_dict[device_id].resync()
+        else:
+            lc_dict[device_id] = LightController(ring, device_name, timezone, confirm_mode)
+
+    groups.clear()
+    for group_config in config.get_light_groups:
+        group_name = group_config.get('name', ','.join(group_config['lights']))
+        device_ids = [device_id for device_id, device_name in wanted.items() if device_name in group_config['lights']]
+        group = LightGroup(group_name, device_ids, group_config.get('duration', DEFAULT_LIGHT_DURATION), lc_dict)
+
+        for trigger_name in group_config['triggers']:
+            trigger_device = ring.get_device_by_name(trigger_name)
+            if not trigger_device:
+                log.error("main::sync_light_controllers: trigger device [%s] for group [%s] not found at Ring, skipping", trigger_name, group_name)
+                continue
+            groups.setdefault(trigger_device.id, []).append(group)
+        log.info("main::sync_light_controllers: group [%s] triggers %s lights %s duration [%s]s", group_name, group_config['triggers'], group_config['lights'], group.duration)
+
+def apply_config(ring: Ring, lc_dict: dict, groups: dict, config: Config) -> None:
+    # config.json changed under us. only the lights that were added or removed get a new
+    # or closed LightController, the rest keep their timers, and the listener is untouched
+    get_rate_limiter(ring, config.get_rate_limit, config.get_rate_burst)
+    get_refresher(ring, config.get_refresh_max_age)
+    before = set(lc_dict)
+    sync_light_controllers(ring, lc_dict, groups, config)
+    log.info("main::apply_config: lights added %s removed %s now %s, %s group triggers", sorted(set(lc_dict) - before), sorted(before - set(lc_dict)), len(lc_dict), len(groups))
+
+async def listen(ring: Ring, account: Account) -> None:
+    # the account's settings, which are the whole of config.json for the default account
+    config = account.config
+    gcm_cache_file = account.gcm_cache_file
+    inventory_file = account.inventory_file
+    account.state = 'starting'
     credentials = None
 
-    if gcm_cache_file.is_file():
-        log.info(f"main::listen: Loading cached GCM credentials from [{gcm_cache_file}]")
-        with open(gcm_cache_file, encoding="utf-8") as f:
-            credentials = json.load(f)
+    if account.gcm_store.exists():
+        log.info("main::listen: Loading cached GCM credentials from [%s]", gcm_cache_file)
+        credentials = account.gcm_store.load()
     else:
         log.info("main::listen: No cached GCM credentials, will register new ones")
     
     # check if credentials were generated
-    log.info(f"main::listen: Credentials file exists now: [{gcm_cache_file.is_file()}]")
-    log.info("main::listen: ring.async_update_data()...")
-    # need to call this here or our LightController's devices are empty
-    await ring.async_update_devices()
-    await ring.async_update_data()
+    log.info("main::listen: Credentials file exists now: [%s]", gcm_cache_file.is_file())
+    limiter = get_rate_limiter(ring, config.get_rate_limit, config.get_rate_burst)
+    refresher = get_refresher(ring, config.get_refresh_max_age)
 
-    log.info(f"main::listen: Setting up RingEventListener with credentials [{gcm_cache_file}]...")
+    refresh_task = None
+    if load_inventory(ring, inventory_file):
+        # build everything from the snapshot and refresh alongside starting the listener
+        log.info("main::listen: using device inventory snapshot [%s], refreshing in the background...", inventory_file)
+        refresh_task = asyncio.create_task(refresh_ring_data(ring, refresher))
+    else:
+        log.info("main::listen: no device inventory snapshot, refreshing ring data...")
+        # need to call this here or our LightController's devices are empty
+        await refresh_ring_data(ring, refresher)
 
-    event_listener = RingEventListener(ring, credentials, credentials_updated_callback)
+    log.info("main::listen: Setting up RingEventListener with credentials [%s]...", gcm_cache_file)
 
-    lc_dict = dict()
-    timezone = config.get_timezone
-    for device_name in config.get_light_devices:
-        ring_device = ring.get_device_by_name(device_name)
+    event_listener = RingEventListener(ring, credentials, account.credentials_updated_callback)
+
+    lc_dict = account.lc_dict
+    groups = dict()
+    sync_light_controllers(ring, lc_dict, groups, config)
+
+    if len(lc_dict) < 1 and refresh_task:
+        log.warning("main::listen: no LightControllers from the inventory snapshot, waiting for fresh data")
+        await refresh_task
+        refresh_task = None
+        sync_light_controllers(ring, lc_dict, groups, config)
 
-        if not ring_device:
-            log.error(f"main::listen: configured light device [{device_name}] not found at Ring, skipping")
-            continue
-        else:
-            # ring_device.id is the id we get on the RingEvents as 'doorbot_id', confusingly
-            lc_dict[ring_device.id] = LightController(ring, device_name, timezone)
-    
     if len(lc_dict) < 1:
-        log.error(f"main::listen: could not instantiate any LightControllers. Exiting...")
+        log.error("main::listen: could not instantiate any LightControllers. Exiting...")
+        account.state = 'failed'
+        account.error = 'no LightControllers'
         return None
 
-    event_handler = RingEventHandler(ring, lc_dict)
-    
-    log.info("main::listen: Starting event_listener...")
-    await event_listener.start()
-    event_listener.add_notification_callback(event_handler.on_event)
+    # everything started from here on is stopped in the finally, so a failure part way
+    # through doesn't leave a listener, workers or savers running into the next restart
+    loop_monitor = None
+    metrics_server = None
+    event_handler = None
+    state_saver = None
+    recorder = None
+    config_watcher = None
+    keep_warm = None
+    try:
+        if config.diagnostics_enabled and account.standalone:
+            loop_monitor = LoopMonitor(config.diagnostics_lag_interval, config.diagnostics_slow_callback, config.diagnostics_report_interval)
+            await loop_monitor.start()
 
-    if event_listener.started:
-        if log.getEffectiveLevel() >= logging.DEBUG:
-            log_debug_info(event_listener)
-        print("main::listen: event_listener.started = True, listening...")
-        await asyncio.get_event_loop().run_in_executor(None, input)
+        if config.metrics_enabled and account.standalone:
+            registry.gauge('log_records_dropped', 'Log records dropped by the bounded log queue', lambda: get_log_stats().get('dropped', 0))
+            metrics_server = MetricsServer(config.metrics_host, config.metrics_port)
+            await metrics_server.start()
 
-    else:
-        log.error("main::listen: Failed to start event_listener")
+        event_handler = RingEventHandler(ring, lc_dict, config.get_event_queue_size, config.get_event_queue_overflow, groups)
+        await event_handler.start()
+        account.event_handler = event_handler
+
+        # carry dedup and pending auto-offs over from the last run, then keep saving them
+        if config.state_snapshot_interval > 0:
+            state = load_state(account.state_file)
+            if state:
+                restore_state(state, event_handler, lc_dict)
+            state_saver = StateSaver(account.state_file, event_handler, lc_dict, config.state_snapshot_interval)
+            await state_saver.start()
+
+        if config.record_file:
+            recorder = EventRecorder(config.record_file)
+
+        # register before starting so nothing that arrives during start is missed
+        if recorder:
+            event_listener.add_notification_callback(recorder.on_event)
+        event_listener.add_notification_callback(event_handler.on_event)
+
+        # collapse the flood of old events Ring sends on sign in
+        if config.catch_up_window > 0:
+            event_handler.begin_catch_up()
+        if config.config_reload_interval > 0:
+            config_watcher = ConfigWatcher(config, lambda: apply_config(ring, lc_dict, groups, config), config.config_reload_interval)
+            await config_watcher.start()
+
+        log.info("main::listen: Starting event_listener...")
+        await event_listener.start()
+        if config.catch_up_window > 0:
+            event_handler.end_catch_up(config.catch_up_window)
+        time_to_listen = time.monotonic() - account.start_time
+        registry.gauge('ring_startup_time_to_listen_seconds', 'Account (re)start to event listener started', lambda: time_to_listen)
+        log.info("main::listen: time to first listen [%.2f]s", time_to_listen)
 
-    await event_listener.stop()
+        if refresh_task:
+            await refresh_task
+            sync_light_controllers(ring, lc_dict, groups, config)
+        await asyncio.get_running_loop().run_in_executor(None, write_inventory, inventory_file, snapshot_inventory(ring))
+
+        if config.keep_warm_enabled:
+            keep_warm = KeepWarm(ring, lc_dict, account.token_store.load, config.keep_warm_interval, config.keep_warm_refresh_margin)
+            await keep_warm.start()
+
+        if event_listener.started:
+            account.state = 'listening'
+            if log.getEffectiveLevel() >= logging.DEBUG:
+                log_debug_info(event_listener)
+            if account.stop_event is None:
+                print("main::listen: event_listener.started = True, listening...")
+                await asyncio.get_event_loop().run_in_executor(None, input)
+            else:
+                log.info("main::listen: [%s] listening...", account.name)
+                await account.stop_event.wait()
+
+        else:
+            log.error("main::listen: Failed to start event_listener")
+            account.state = 'failed'
+            account.error = 'event listener did not start'
+    finally:
+        if refresh_task and not refresh_task.done():
+            refresh_task.cancel()
+        if keep_warm:
+            await keep_warm.stop()
+            log.info("main::listen: [%s] keep warm stats %s", account.name, keep_warm.stats())
+        if config_watcher:
+            await config_watcher.stop()
+        await event_listener.stop()
+        if event_handler:
+            await event_handler.stop()
+        if state_saver:
+            await state_saver.stop()
+        if recorder:
+            recorder.close()
+        if metrics_server:
+            await metrics_server.stop()
+        if loop_monitor:
+            await loop_monitor.stop()
+        if account.state != 'failed':
+            account.state = 'stopped'
+        log.info("main::listen: [%s] device refresh stats %s rate limiter stats %s off scheduler stats %s", account.name, refresher.stats(), limiter.stats(), get_off_scheduler(ring).stats())
+
+async def run_account(account: Account, started: float = None) -> None:
+    # started defaults to now, main passes the process start so the first run counts the imports too
+    account.start_time = started if started is not None else time.monotonic()
+    account.state = 'authenticating'
+    account.http_session = create_http_session()
+    try:
+        ring = await _get_ring(None, None, None, account)
+        await listen(ring, account)
+    finally:
+        await asyncio.gather(account.token_store.flush(), account.gcm_store.flush())
+        await account.http_session.close()
 
 async def main():
-    ring = await _get_ring(None, None, None, user_agent)
-    await listen(ring)
+    await run_account(Account(config, user_agent=user_agent), start_time)
     
-    log.info("main::main: Clean shutdown")
+    log.info("main::main: Clean shutdown, log stats %s", get_log_stats())
 
 if __name__ == "__main__":
-    config = Config('src/config.json')
     asyncio.run(main())
@@ -0,0 +1,142 @@
+import argparse
+import logging
+from util.async_logger import setup_logger
+log = setup_logger('ring_automation', level=logging.INFO, console=False)
+import asyncio
+import json
+import time
+from ring.eventrecorder import load_capture
+from ring.fakering import FakeRing
+from ring.lightcontroller import LightController
+from ring.ringeventhandler import MAX_EVENT_AGE, RingEventHandler
+from ring_doorbell import RingEventKind
+
+# replay a jsonl capture recorded by main.py (record_file in config.json) through
+# RingEventHandler/LightController against a FakeRing, faster than real time, e.g.
+#   python src/replay.py captures/events.jsonl --speed 20 --latency 0.2 --lag 1.0
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+async def wait_light_on(lc: LightController, started: float, timeout: float) -> float:
+    # seconds from handing the event over until the light reports on, None if it never did
+    while time.monotonic() - started < timeout:
+        if lc.is_on:
+            return time.monotonic() - started
+        await asyncio.sleep(0.005)
+    return None
+
+async def wait_idle(lc_dict: dict[int, LightController], timeout: float) -> None:
+    # let the last auto-offs and any command loops finish
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        busy = [lc for lc in lc_dict.values()
+                if (lc._command_task and not lc._command_task.done()) or lc.off_pending]
+        if not busy:
+            return None
+        await asyncio.sleep(0.05)
+    log.warning("replay::wait_idle: lights still busy after [%s]s", timeout)
+
+async def replay(args) -> dict:
+    events = load_capture(args.capture)
+    if not events:
+        raise SystemExit(f"replay: no events in [{args.capture}]")
+
+    devices = {event.doorbot_id: event.device_name for _, event in events}
+    lights = args.lights or list(devices.values())
+    ring = FakeRing(devices, args.latency, args.failure_rate, args.lag, seed=args.seed)
+
+    lc_dict = dict()
+    for device_id, device_name in devices.items():
+        if device_name not in lights:
+            continue
+        lc = LightController(ring, device_name, args.timezone)
+        if not args.real_daylight:
+            lc.is_dark = lambda: True
+        lc_dict[device_id] = lc
+
+    event_handler = RingEventHandler(ring, lc_dict)
+    # compress the auto-off time along with the event gaps
+    event_handler.light_duration = args.duration / args.speed
+    await event_handler.start()
+
+    counts = {'events': len(events), 'measured': 0, 'old': 0, 'foreign': 0, 'other_kind': 0, 'already_on': 0, 'timed_out': 0}
+    watchers = []
+    first_received = events[0][0]
+    start = time.monotonic()
+
+    for received, event in events:
+        delay = (received - first_received) / args.speed - (time.monotonic() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # keep the age the event had when it was originally received
+        age = received - event.now
+        event.now = time.time() - age
+
+        lc = lc_dict.get(event.doorbot_id)
+        if lc is None:
+            counts['foreign'] += 1
+        elif event.kind != RingEventKind.MOTION.value:
+            counts['other_kind'] += 1
+        elif age > MAX_EVENT_AGE:
+            counts['old'] += 1
+        elif lc.is_on:
+            counts['already_on'] += 1
+        else:
+            watchers.append(asyncio.create_task(wait_light_on(lc, time.monotonic(), args.timeout)))
+        event_handler.on_event(event)
+
+    latencies = []
+    for latency in await asyncio.gather(*watchers):
+        if latency is None:
+            counts['timed_out'] += 1
+        else:
+            counts['measured'] += 1
+            latencies.append(latency)
+
+    await wait_idle(lc_dict, event_handler.light_duration + args.timeout)
+    wall_time = time.monotonic() - start
+    await event_handler.stop()
+
+    capture_span = events[-1][0] - first_received
+    return {
+        'capture': args.capture,
+        **counts,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+            'p95': round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+            'max': round(max(latencies) * 1000, 1) if latencies else None,
+        },
+        'api_calls': dict(ring.api_calls),
+        'api_failures': ring.failures,
+        'commands_requested': sum(lc.commands_requested for lc in lc_dict.values()),
+        'commands_sent': sum(lc.commands_sent for lc in lc_dict.values()),
+        'capture_span_s': round(capture_span, 3),
+        'wall_time_s': round(wall_time, 3),
+        'speedup': round(capture_span / wall_time, 2) if wall_time else None,
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay a recorded RingEvent capture against a fake Ring backend')
+    parser.add_argument('capture', help='jsonl capture file written by main.py')
+    parser.add_argument('--speed', type=float, default=10.0, help='replay speed multiplier (default 10)')
+    parser.add_argument('--latency', type=float, default=0.1, help='fake API call latency in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='chance (0-1) a fake API call fails')
+    parser.add_argument('--lag', type=float, default=0.5, help='seconds before a light change is visible')
+    parser.add_argument('--duration', type=float, default=30.0, help='light on duration in capture time')
+    parser.add_argument('--timeout', type=float, default=15.0, help='seconds to wait for a light to come on')
+    parser.add_argument('--lights', nargs='*', help='device names to control, default every device in the capture')
+    parser.add_argument('--timezone', default='Europe/London')
+    parser.add_argument('--real-daylight', action='store_true', help='honour is_dark instead of treating it as always dark')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the fake failure injection')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.speed <= 0:
+        raise SystemExit("replay: --speed must be > 0")
+    print(json.dumps(asyncio.run(replay(args)), indent=2))
@@ -0,0 +1,40 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import json
+from pathlib import Path
+from ring_doorbell import Ring
+from util.atomicfile import write_json_atomic
+
+# the device attrs we need to build LightControllers before the first refresh comes back
+INVENTORY_ATTRS = ('id', 'description', 'kind', 'latitude', 'longitude', 'location_id', 'led_status')
+
+def snapshot_inventory(ring: Ring) -> dict:
+    # {family: [attrs, ...]} for every device on the account. whether it has a light comes
+    # from kind, which is in INVENTORY_ATTRS
+    return {
+        family: [{key: attrs[key] for key in INVENTORY_ATTRS if key in attrs} for attrs in devices.values()]
+        for family, devices in ring.devices_data.items()
+    }
+
+def write_inventory(inventory_file: Path, snapshot: dict) -> None:
+    write_json_atomic(inventory_file, snapshot, separators=(',', ':'))
+    logger.debug("deviceinventory::write_inventory: saved %s devices to [%s]", sum(len(d) for d in snapshot.values()), inventory_file)
+
+def load_inventory(ring: Ring, inventory_file: Path) -> bool:
+    # seed ring.devices_data from the snapshot, returns False if there's nothing usable
+    inventory_file = Path(inventory_file)
+    if not inventory_file.is_file():
+        return False
+    try:
+        with open(inventory_file, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        ring.devices_data = {
+            # only INVENTORY_ATTRS, older snapshots also have a has_light
+            family: {entry['id']: {key: value for key, value in entry.items() if key in INVENTORY_ATTRS} for entry in entries}
+            for family, entries in snapshot.items()
+        }
+    except Exception as e:
+        logger.error("deviceinventory::load_inventory: could not load [%s]: [%s]", inventory_file, e)
+        return False
+    logger.info("deviceinventory::load_inventory: loaded %s devices from [%s]", sum(len(d) for d in ring.devices_data.values()), inventory_file)
+    return bool(ring.devices_data)
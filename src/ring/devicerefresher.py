@@ -0,0 +1,77 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import asyncio
+import time
+from ring_doorbell import Ring
+from ring.ratelimiter import PRIORITY_REFRESH, get_rate_limiter
+
+# how long a completed refresh is good for before callers trigger another one
+DEFAULT_MAX_AGE = 2.0
+
+class DeviceRefresher:
+    # single-flight wrapper around ring.async_update_devices(). concurrent callers await the
+    # one refresh in flight and a completed refresh is reused until it's older than max_age.
+    # age is measured from when the refresh started, so a reused result is never older than that
+    def __init__(self, ring: Ring, max_age: float = DEFAULT_MAX_AGE):
+        self.ring = ring
+        self.limiter = get_rate_limiter(ring)
+        self.max_age = max_age
+        self._task = None
+        self._last_refresh = None
+
+        self.requested = 0
+        self.performed = 0
+        # callers that joined a refresh already in flight
+        self.coalesced = 0
+        # callers answered from a refresh younger than max_age
+        self.reused = 0
+
+    @property
+    def saved(self) -> int:
+        return self.coalesced + self.reused
+
+    async def refresh(self, max_age: float = None) -> None:
+        if max_age is None:
+            max_age = self.max_age
+        self.requested += 1
+
+        if self._task and not self._task.done():
+            self.coalesced += 1
+            logger.debug("devicerefresher::refresh: joining in-flight refresh, saved [%s]", self.saved)
+            # shield so a cancelled caller doesn't cancel the refresh everyone else is waiting on
+            await asyncio.shield(self._task)
+            return None
+
+        if self._last_refresh is not None and time.monotonic() - self._last_refresh < max_age:
+            self.reused += 1
+            logger.debug("devicerefresher::refresh: reusing refresh from [%.2f]s ago, saved [%s]", time.monotonic() - self._last_refresh, self.saved)
+            return None
+
+        self._task = asyncio.create_task(self._refresh())
+        await asyncio.shield(self._task)
+
+    async def _refresh(self) -> None:
+        start = time.monotonic()
+        await self.limiter.call(PRIORITY_REFRESH, self.ring.async_update_devices)
+        self._last_refresh = start
+        self.performed += 1
+        logger.debug("devicerefresher::_refresh: refreshed devices in [%.2f]s performed [%s] saved [%s]", time.monotonic() - start, self.performed, self.saved)
+
+    def stats(self) -> dict:
+        return {
+            'requested': self.requested,
+            'performed': self.performed,
+            'coalesced': self.coalesced,
+            'reused': self.reused,
+            'saved': self.saved,
+        }
+
+def get_refresher(ring: Ring, max_age: float = None) -> DeviceRefresher:
+    # one refresher per Ring object, shared by every LightController on that account
+    refresher = getattr(ring, 'device_refresher', None)
+    if refresher is None:
+        refresher = DeviceRefresher(ring, DEFAULT_MAX_AGE if max_age is None else max_age)
+        ring.device_refresher = refresher
+    elif max_age is not None:
+        refresher.max_age = max_age
+    return refresher
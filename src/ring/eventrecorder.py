@@ -0,0 +1,74 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import json
+import threading
+import time
+from dataclasses import asdict
+from pathlib import Path
+from queue import Full, Queue
+from ring_doorbell import RingEvent
+
+# events waiting for the writer thread, beyond this they're dropped rather than block the loop
+MAX_PENDING = 10000
+
+class EventRecorder:
+    # appends every RingEvent we're sent to a jsonl capture, one event per line plus
+    # the wall clock time we received it, for replay.py to feed back in later.
+    # on_event only queues the event, like the log QueueHandler, a writer thread
+    # serialises and writes them and flushes whenever it has caught up
+    def __init__(self, capture_file: str):
+        self.capture_file = Path(capture_file)
+        self.capture_file.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.capture_file, 'a', encoding='utf-8')
+        self._queue = Queue(MAX_PENDING)
+        self._thread = threading.Thread(target=self._write_loop, name='eventrecorder', daemon=True)
+        self._thread.start()
+        self.recorded = 0
+        self.dropped = 0
+        logger.info("eventrecorder::init: recording events to [%s]", self.capture_file)
+
+    def on_event(self, event: RingEvent) -> None:
+        try:
+            self._queue.put_nowait((time.time(), event))
+        except Full:
+            self.dropped += 1
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            received, event = item
+            try:
+                record = asdict(event)
+                record['received'] = received
+                self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+                self.recorded += 1
+            except Exception as e:
+                logger.error("eventrecorder::_write_loop: failed to record event [%s]: [%s]", event.id, e)
+            if self._queue.empty():
+                self._file.flush()
+        self._file.flush()
+
+    def close(self) -> None:
+        # writes out whatever is still queued first
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if not self._file.closed:
+            self._file.close()
+        logger.info("eventrecorder::close: recorded [%s] events to [%s], dropped [%s]", self.recorded, self.capture_file, self.dropped)
+
+def load_capture(capture_file: str) -> list[tuple[float, RingEvent]]:
+    # returns (received, event) pairs in the order they were received
+    events = []
+    with open(capture_file, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            received = record.pop('received', record['now'])
+            events.append((received, RingEvent(**record)))
+    events.sort(key=lambda e: e[0])
+    return events
@@ -0,0 +1,87 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import asyncio
+import copy
+import random
+from collections import Counter
+from ring_doorbell import RingError, RingStickUpCam
+
+FLOODLIGHT_KIND = 'cocoa_floodlight'
+
+class FakeRing:
+    # in-process stand-in for Ring, just enough of it for LightController and RingEventHandler.
+    # devices are real RingStickUpCam objects, only the API underneath them is faked:
+    #  - latency: seconds every API call takes
+    #  - failure_rate: chance (0-1) an API call raises RingError
+    #  - lag: seconds before a light change shows up when the device is read back
+    def __init__(self, devices: dict[int, str], latency: float = 0.1, failure_rate: float = 0.0,
+                 lag: float = 0.5, latitude: float = 51.5, longitude: float = -0.1, seed: int = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.lag = lag
+        self.session = {}
+        self._random = random.Random(seed)
+
+        # what the 'cloud' thinks, devices_data is what we've last read from it
+        self._backend = {
+            'stickup_cams': {
+                device_id: {
+                    'id': device_id,
+                    'description': device_name,
+                    'kind': FLOODLIGHT_KIND,
+                    'led_status': 'off',
+                    'latitude': latitude,
+                    'longitude': longitude,
+                }
+                for device_id, device_name in devices.items()
+            }
+        }
+        self.devices_data = copy.deepcopy(self._backend)
+
+        self.api_calls = Counter()
+        self.failures = 0
+
+    def get_device_by_name(self, device_name: str) -> RingStickUpCam:
+        for device_id, attrs in self.devices_data['stickup_cams'].items():
+            if attrs['description'] == device_name:
+                return RingStickUpCam(self, device_id)
+        return None
+
+    async def _api_call(self, kind: str) -> None:
+        self.api_calls[kind] += 1
+        await asyncio.sleep(self.latency)
+        if self._random.random() < self.failure_rate:
+            self.failures += 1
+            raise RingError(f"fakering: injected failure for [{kind}]")
+
+    async def async_query(self, url: str, method: str = 'GET', **kwargs):
+        # /clients_api/doorbots/{id} or /clients_api/doorbots/{id}/floodlight_light_{on|off}
+        parts = url.strip('/').split('/')
+        device_id = int(parts[2])
+
+        if method == 'PUT' and len(parts) > 3 and parts[3].startswith('floodlight_light_'):
+            await self._api_call('set_light')
+            state = parts[3].rsplit('_', 1)[1]
+            asyncio.get_running_loop().call_later(self.lag, self._set_led_status, device_id, state)
+            return FakeResponse(None)
+
+        await self._api_call('get_device')
+        return FakeResponse(copy.deepcopy(self._backend['stickup_cams'][device_id]))
+
+    def _set_led_status(self, device_id: int, state: str) -> None:
+        self._backend['stickup_cams'][device_id]['led_status'] = state
+
+    async def async_update_devices(self) -> None:
+        await self._api_call('update_devices')
+        self.devices_data = copy.deepcopy(self._backend)
+
+    async def async_update_data(self) -> None:
+        await self.async_update_devices()
+
+class FakeResponse:
+    def __init__(self, data):
+        self._data = data
+        self.status_code = 200
+
+    def json(self):
+        return self._data
@@ -0,0 +1,111 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import asyncio
+import time
+import aiohttp
+from ring_doorbell import Ring
+from ring.ratelimiter import PRIORITY_KEEP_WARM, get_rate_limiter
+from util.metrics import registry
+
+# seconds between keep warm checks, comfortably inside KEEPALIVE_TIMEOUT
+DEFAULT_INTERVAL = 45.0
+# refresh the oauth token when it has less than this long left
+DEFAULT_REFRESH_MARGIN = 600.0
+# how long the session keeps an idle connection pooled. aiohttp's default is 15s, which is
+# shorter than the gap between most motion events, so nearly every command paid for a new TLS handshake
+KEEPALIVE_TIMEOUT = 120.0
+
+KEEP_WARM_PINGS = registry.counter('ring_keep_warm_pings_total', 'Keep warm requests sent to hold the Ring connection open')
+TOKEN_REFRESHES = registry.counter('ring_keep_warm_token_refreshes_total', 'OAuth tokens refreshed ahead of expiry')
+
+def create_http_session(keepalive_timeout: float = KEEPALIVE_TIMEOUT) -> aiohttp.ClientSession:
+    # passed to Auth as http_client_session so the connection pool outlives aiohttp's default
+    # keepalive. Auth doesn't close a session it was given, the caller has to
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(keepalive_timeout=keepalive_timeout))
+
+class KeepWarm:
+    # while it's dark, when a motion event could turn a light on, keep the Ring session ready
+    # for a command: refresh the token before it expires rather than on the command that finds
+    # it expired, and if nothing has used the connection for an interval, poll one light so
+    # the pooled connection stays open. during the day it does nothing.
+    # token_fn returns the current oauth token, i.e. what Auth last passed its token_updater
+    def __init__(self, ring: Ring, lightcontrollers: dict, token_fn, interval: float = DEFAULT_INTERVAL,
+                 refresh_margin: float = DEFAULT_REFRESH_MARGIN):
+        self.ring = ring
+        self.token_fn = token_fn
+        self.lightcontrollers = lightcontrollers
+        self.interval = interval
+        self.refresh_margin = refresh_margin
+        self.limiter = get_rate_limiter(ring)
+        self._task = None
+        self._next = 0
+
+        self.pings = 0
+        self.refreshes = 0
+        self.errors = 0
+        # checks skipped because it was light, or because the connection had been used recently
+        self.skipped_light = 0
+        self.skipped_busy = 0
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        logger.info("keepwarm::start: keeping the Ring session warm every [%s]s while dark", self.interval)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                # a failed ping or refresh just means the next command goes cold, keep going
+                self.errors += 1
+                logger.warning("keepwarm::_run: keep warm failed: [%s]", e)
+
+    async def check(self) -> None:
+        lights = [lc for lc in self.lightcontrollers.values() if lc.has_light]
+        if not lights or not any(lc.solar_schedule.is_dark() for lc in lights):
+            self.skipped_light += 1
+            return None
+
+        await self._refresh_token()
+
+        idle = time.monotonic() - self.limiter.last_call
+        if idle < self.interval:
+            self.skipped_busy += 1
+            return None
+        # round robin so every light's state gets refreshed along the way
+        lc = lights[self._next % len(lights)]
+        self._next += 1
+        await lc.refresh(PRIORITY_KEEP_WARM)
+        self.pings += 1
+        KEEP_WARM_PINGS.inc()
+        logger.debug("keepwarm::check: pinged via [%s] after [%.1f]s idle", lc.device_name, idle)
+
+    async def _refresh_token(self) -> None:
+        token = self.token_fn() or {}
+        expires_at = token.get('expires_at')
+        if expires_at is None:
+            return None
+        remaining = expires_at - time.time()
+        if remaining > self.refresh_margin:
+            return None
+        # token_updater hands the new token back to whatever token_fn reads
+        await self.ring.auth.async_refresh_tokens()
+        self.refreshes += 1
+        TOKEN_REFRESHES.inc()
+        logger.info("keepwarm::_refresh_token: refreshed token with [%.0f]s left", remaining)
+
+    def stats(self) -> dict:
+        return {
+            'pings': self.pings,
+            'refreshes': self.refreshes,
+            'errors': self.errors,
+            'skipped_light': self.skipped_light,
+            'skipped_busy': self.skipped_busy,
+        }
@@ -1,17 +1,47 @@
 from util.logger import logging
 logger = logging.getLogger('ring_automation')
 import asyncio
+import time
 from typing import cast
 from ring_doorbell import Ring, RingCapability, RingStickUpCam
-from astral import LocationInfo
-from astral.sun import sun
-from datetime import datetime
+from ring_doorbell.const import DOORBELLS_ENDPOINT
+from ring.devicerefresher import get_refresher
+from ring.keepwarm import KEEPALIVE_TIMEOUT
+from ring.offscheduler import get_off_scheduler
+from ring.ratelimiter import PRIORITY_LIGHT_OFF, PRIORITY_LIGHT_ON, PRIORITY_POLL, get_rate_limiter
+from ring.solarschedule import get_solar_schedule
+from util.metrics import registry
 import pytz
 
+# 'poll' re-reads just this device with backoff until the light matches the request
+# 'refresh' is the old behaviour, sleep then refresh every device on the account
+CONFIRM_POLL = 'poll'
+CONFIRM_REFRESH = 'refresh'
+CONFIRM_INITIAL_DELAY = 0.25
+CONFIRM_MAX_DELAY = 2.0
+CONFIRM_TIMEOUT = 10.0
+# retries when the light doesn't reach the requested state
+COMMAND_MAX_ATTEMPTS = 3
+COMMAND_RETRY_DELAY = 5.0
+# a command sent after the connection has been idle longer than the session keeps it pooled
+# counts as cold, it pays for a new TLS handshake (and maybe a token refresh) first
+COLD_IDLE = KEEPALIVE_TIMEOUT
+
+EVENT_TO_COMMAND = registry.histogram('ring_event_to_command_seconds', 'on_event to async_set_light start')
+API_CALL_DURATION = registry.histogram('ring_set_light_api_seconds', 'async_set_light call duration')
+CONFIRM_DURATION = registry.histogram('ring_set_light_confirm_seconds', 'async_set_light return to light state confirmed')
+API_CALL_COLD = registry.histogram('ring_set_light_api_cold_seconds', 'async_set_light call duration after the Ring connection was idle')
+API_CALL_WARM = registry.histogram('ring_set_light_api_warm_seconds', 'async_set_light call duration on a recently used Ring connection')
+
 class LightController:
-    def __init__(self, ring: Ring, device_name, timezone: str):
-        self._turn_off_task = None
+    def __init__(self, ring: Ring, device_name, timezone: str, confirm_mode: str = CONFIRM_POLL):
+        self.confirm_mode = confirm_mode
+        # seconds the last set_lights took to see the requested state, None if it never did
+        self.last_confirm_time = None
         self.ring = ring
+        self.refresher = get_refresher(ring)
+        self.off_scheduler = get_off_scheduler(ring)
+        self.limiter = get_rate_limiter(ring)
         self.device_name = device_name
         self.device = ring.get_device_by_name(device_name)
         
@@ -21,79 +51,202 @@ class LightController:
             self.timezone = pytz.timezone(timezone)
         
         if not self.device:
-            logger.error(f"lightcontroller::init: got unknown device [{device_name}]")
+            logger.error("lightcontroller::init: got unknown device [%s]", device_name)
             return None
         if not self.device.has_capability(RingCapability.LIGHT):
-            logger.error(f"lightcontroller::init: device [{device_name}] does not have a light...")
+            logger.error("lightcontroller::init: device [%s] does not have a light...", device_name)
             return None
         self.floodlight = cast(RingStickUpCam, self.device)
         self._is_on = self.floodlight.light
         self._setting_light = False
+        # newest requested light state and the loop that applies it
+        self._desired = self._is_on
+        self._command_task = None
+        # monotonic time the event behind the pending request arrived, for EVENT_TO_COMMAND
+        self._requested_at = None
+        self.commands_requested = 0
+        self.commands_sent = 0
 
-        # lat/lon for sunset/sunrise times
-        self.location = LocationInfo(latitude=self.device.latitude, longitude=self.device.longitude)
+        # lat/lon for sunset/sunrise times, shared with any other lights at the same location
+        self.solar_schedule = get_solar_schedule(self.device.latitude, self.device.longitude, self.timezone)
 
-        logger.info(f"lightcontroller::init: is_dark [{self.is_dark()}]")
+        logger.info("lightcontroller::init: is_dark [%s]", self.is_dark())
 
-    async def set_lights(self, enable: bool, duration: int) -> None:
+    async def set_lights(self, enable: bool, duration: int, received: float = None) -> None:
         # i suppose we might hit a situation where we receive enable=False but we've
         # ticked over between 'dark' and 'light' between the ring API trigger and getting here
         # so should probably handle that by checking the value of enable here too. i.e. it's always
-        # ok to turn the lights _off_ if it's light outside
+        # ok to turn the lights _off_ if it's light outside
         if not self.is_dark() and enable:
-            logger.debug(f"lightcontroller::set_lights: not dark, ignoring lights on request")
-            return None
-        
-        if enable and (self._turn_off_task and not self._turn_off_task.done()):
-            logger.debug(f"lightcontroller::set_lights: cancelling existing _turn_off_task and creating a new one")
-            self._turn_off_task.cancel()
-            self._turn_off_task = None
-            self._turn_off_task = asyncio.create_task(self._auto_off(duration))
+            logger.debug("lightcontroller::set_lights: not dark, ignoring lights on request")
             return None
 
-        if self._setting_light:
-            logger.debug(f"lightcontroller::set_lights: _setting_light [{self._setting_light}] API call in progress, skipping")
-            return None
+        if enable:
+            # push the off deadline out from this motion, whether or not the light is already on.
+            # the scheduler never brings a deadline forward, e.g. a shorter group duration overlapping a longer one
+            self.off_scheduler.schedule(self, duration, self._auto_off)
 
-        if (enable and self._is_on) or (not enable and not self._is_on):
-            logger.warning(f"lightcontroller::set_lights: {self.floodlight.name} light is already {self._is_on}")
-            return None
+        # last write wins, the command loop always works towards the newest request
+        if enable != self._desired or self._requested_at is None:
+            self._requested_at = received
+        self._desired = enable
+        self.commands_requested += 1
+
+        if self._command_task is None or self._command_task.done():
+            if enable == self._is_on:
+                logger.debug("lightcontroller::set_lights: %s light is already [%s]", self.device_name, self._is_on)
+                return None
+            self._command_task = asyncio.create_task(self._run_commands())
+        else:
+            logger.debug("lightcontroller::set_lights: %s API call in progress, coalescing to [%s]", self.device_name, enable)
+
+        # shield so a cancelled caller can't kill the loop
+        await asyncio.shield(self._command_task)
 
-        self._setting_light = True
-        try:
-            await self.floodlight.async_set_light(enable)
+    async def _run_commands(self) -> None:
+        # at most one API call in flight per light. after each call re-check the newest
+        # request and only send another if we're not already there
+        attempts = 0
+        while self._desired != self._is_on:
+            enable = self._desired
+            self._setting_light = True
+            try:
+                await self._send_light(enable)
+            except Exception as e:
+                logger.error("lightcontroller::_run_commands: %s error setting light [%s]: [%s]", self.device_name, enable, e)
+            finally:
+                self._setting_light = False
+
+            if self._is_on == enable or self._desired != enable:
+                attempts = 0
+                continue
+
+            attempts += 1
+            if attempts >= COMMAND_MAX_ATTEMPTS:
+                logger.error("lightcontroller::_run_commands: %s light still [%s] after [%s] attempts, giving up", self.device_name, self._is_on, attempts)
+                return None
+            # probably a lag in the light changing, give it a moment then try again
+            logger.warning("lightcontroller::_run_commands: inconsistent state after request [%s] self.floodlight.light = [%s] retrying in [%s]s", enable, self.floodlight.light, COMMAND_RETRY_DELAY)
+            await asyncio.sleep(COMMAND_RETRY_DELAY)
+
+    async def _send_light(self, enable: bool) -> None:
+        self.commands_sent += 1
+        start = time.monotonic()
+        if self._requested_at is not None:
+            EVENT_TO_COMMAND.observe(start - self._requested_at)
+            self._requested_at = None
+        # timed from when the limiter lets it go, the wait before that is ring_api_queue_wait_seconds
+        _, api_duration, idle = await self.limiter.timed_call(PRIORITY_LIGHT_ON if enable else PRIORITY_LIGHT_OFF, self.floodlight.async_set_light, enable)
+        API_CALL_DURATION.observe(api_duration)
+        (API_CALL_COLD if idle > COLD_IDLE else API_CALL_WARM).observe(api_duration)
+        if self.confirm_mode == CONFIRM_REFRESH:
             # this is a bit of a hack but it seems we need to wait for the light status to resync
             await asyncio.sleep(3)
-            await self.ring.async_update_devices()
-            self._is_on = self.floodlight.light
-
-            logger.info(f"lightcontroller::set_lights: {self.floodlight.name} light: requested [{enable}] current state [{self.floodlight.light}]")
-            if not enable and self.floodlight.light:
-                # probably a lag turning it off, schedule another attempt/check in 10s
-                logger.warning(f"lightcontroller::set_lights: inconsistent state after disabler request self.is_on = [{self._is_on}] self.floodlight.light = [{self.floodlight.light}] scheduling another off task")
-                self._turn_off_task = asyncio.create_task(self._auto_off(10))
-
-            if enable:
-                self._turn_off_task = asyncio.create_task(self._auto_off(duration))
-        finally:
-            self._setting_light = False
-
-    async def _auto_off(self, duration: int) -> None:
-        try:
-            logger.info(f"lightcontroller::_auto_off: scheduled new off task for [{duration}]s")
-            await asyncio.sleep(duration)
-            await self.set_lights(False, None)
-        except asyncio.CancelledError:
-            logger.debug(f"lightcontroller::_auto_off: canceling existing off task for new motion")
+            await self.refresher.refresh()
+        else:
+            await self._confirm_light(enable)
+        self._is_on = self.floodlight.light
+
+        logger.info("lightcontroller::_send_light: %s light: requested [%s] current state [%s] confirm_time [%s] sent [%s] requested [%s]", self.floodlight.name, enable, self.floodlight.light, self.last_confirm_time, self.commands_sent, self.commands_requested)
+
+    async def _confirm_light(self, enable: bool) -> bool:
+        # poll only this device with increasing backoff until the light reports what we asked for
+        start = time.monotonic()
+        delay = CONFIRM_INITIAL_DELAY
+        self.last_confirm_time = None
+
+        while time.monotonic() - start < CONFIRM_TIMEOUT:
+            await asyncio.sleep(delay)
+            await self._update_device()
+            if self.floodlight.light == enable:
+                self.last_confirm_time = time.monotonic() - start
+                CONFIRM_DURATION.observe(self.last_confirm_time)
+                logger.debug("lightcontroller::_confirm_light: %s light [%s] confirmed in [%.2f]s", self.device_name, enable, self.last_confirm_time)
+                return True
+            delay = min(delay * 2, CONFIRM_MAX_DELAY)
+
+        logger.warning("lightcontroller::_confirm_light: %s light not [%s] after [%s]s", self.device_name, enable, CONFIRM_TIMEOUT)
+        return False
+
+    async def refresh(self, priority: int = PRIORITY_POLL) -> None:
+        # re-read just this light from Ring, e.g. to keep the connection open, see ring/keepwarm.py
+        await self._update_device(priority)
+
+    async def _update_device(self, priority: int = PRIORITY_POLL) -> None:
+        # refresh this device's attrs in place rather than everything on the account
+        resp = await self.limiter.call(priority, self.ring.async_query, DOORBELLS_ENDPOINT.format(self.floodlight.device_api_id))
+        data = resp.json()
+        data = data.get('doorbot', data)
+        if 'led_status' not in data:
+            logger.debug("lightcontroller::_update_device: no led_status for %s, falling back to a full refresh", self.device_name)
+            await self.refresher.refresh()
+            return None
+        self.ring.devices_data[self.floodlight.family][self.floodlight.device_api_id].update(data)
+
+    async def _auto_off(self) -> None:
+        logger.info("lightcontroller::_auto_off: %s off deadline reached", self.device_name)
+        await self.set_lights(False, None)
+
+    @property
+    def has_light(self) -> bool:
+        # False for an unknown device or one without a light, __init__ stops before setting
+        # up the rest of the state for those
+        return hasattr(self, 'floodlight')
+
+    @property
+    def is_on(self) -> bool:
+        # as last seen or confirmed, False if it isn't a light
+        return self.has_light and self._is_on
+
+    def snapshot(self) -> dict:
+        # what runtimestate saves for this light. off_deadline is in loop time
+        return {
+            # a crash mid-command may have left it on, so count a pending on as on
+            'on': self._is_on or self._desired,
+            'off_deadline': self.off_scheduler.deadline(self),
+        }
+
+    def restore_off(self, delay: float, was_on: bool = False) -> None:
+        # re-arm an auto-off carried over from before a restart. if we had it on, trust that
+        # over a possibly older device snapshot until the next refresh resyncs it
+        if was_on:
+            self._is_on = self._desired = True
+        self.off_scheduler.schedule(self, delay, self._auto_off)
+
+    @property
+    def off_pending(self) -> bool:
+        return self.off_scheduler.deadline(self) is not None
+
+    def reconfigure(self, timezone: str, confirm_mode: str) -> None:
+        # settings from a reloaded config, the light's timer and any command in flight carry on
+        self.confirm_mode = confirm_mode
+        # resync() picks up the solar schedule for the new timezone
+        self.timezone = pytz.timezone(timezone or "Europe/London")
+
+    def resync(self) -> None:
+        # pick up fresh device data, e.g. after starting from a device inventory snapshot
+        if not self.has_light:
+            return None
+        self.solar_schedule = get_solar_schedule(self.device.latitude, self.device.longitude, self.timezone)
+        if self._command_task and not self._command_task.done():
+            return None
+        self._is_on = self.floodlight.light
+        if self.commands_requested == 0:
+            self._desired = self._is_on
+        elif self._desired != self._is_on:
+            logger.info("lightcontroller::resync: %s light is [%s], wanted [%s]", self.device_name, self._is_on, self._desired)
+            self._command_task = asyncio.create_task(self._run_commands())
+
+    def close(self) -> None:
+        # stop anything still scheduled for a light we're no longer controlling
+        self.off_scheduler.cancel(self)
+        if not self.has_light:
+            # so there's no command loop either
+            return None
+        if self._command_task and not self._command_task.done():
+            self._command_task.cancel()
 
     def is_dark(self) -> bool:
-        now = datetime.now(self.timezone)
-        s = sun(self.location.observer, date=now.date(), tzinfo=self.timezone)
-        
-        sunrise = s['sunrise']
-        sunset = s['sunset']
-        
-        is_dark = now < sunrise or now > sunset
-        logger.debug(f"lightcontroller::is_dark: now [{now.strftime('%H:%M')}] sunrise [{sunrise.strftime('%H:%M')}] sunset [{sunset.strftime('%H:%M')}], is_dark [{is_dark}]")
+        is_dark = self.solar_schedule.is_dark()
+        logger.debug("lightcontroller::is_dark: [%s] is_dark [%s]", self.device_name, is_dark)
         return is_dark
-    
\ No newline at end of file
@@ -0,0 +1,36 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import asyncio
+import time
+from ring.lightcontroller import LightController
+from util.metrics import registry
+
+GROUP_LATENCY = registry.histogram('ring_group_confirm_seconds', 'Group trigger to the slowest light in the group confirmed')
+
+class LightGroup:
+    # a set of lights switched together when any of the group's trigger cameras see motion.
+    # lights are looked up in lightcontrollers on every use so a rebuilt controller is picked up
+    def __init__(self, name: str, device_ids: list[int], duration: int, lightcontrollers: dict[int, LightController]):
+        self.name = name
+        self.device_ids = device_ids
+        self.duration = duration
+        self.lightcontrollers = lightcontrollers
+        # seconds from trigger to the slowest light confirming, for the last switch
+        self.last_latency = None
+
+    @property
+    def lights(self) -> list[LightController]:
+        return [self.lightcontrollers[device_id] for device_id in self.device_ids if device_id in self.lightcontrollers]
+
+    async def set_lights(self, enable: bool, received: float = None) -> None:
+        start = received if received is not None else time.monotonic()
+        lights = self.lights
+        # all at once rather than one after another, each light still has its own command loop
+        results = await asyncio.gather(*(lc.set_lights(enable, self.duration, received) for lc in lights), return_exceptions=True)
+        for lc, result in zip(lights, results):
+            if isinstance(result, Exception):
+                logger.error("lightgroup::set_lights: [%s] error setting [%s]: [%s]", self.name, lc.device_name, result)
+
+        self.last_latency = time.monotonic() - start
+        GROUP_LATENCY.observe(self.last_latency)
+        logger.info("lightgroup::set_lights: [%s] %s lights [%s] settled in [%.2f]s", self.name, len(lights), enable, self.last_latency)
@@ -0,0 +1,120 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import asyncio
+import heapq
+from ring_doorbell import Ring
+
+# rebuild the heap once stale entries outnumber live ones by this much
+COMPACT_FACTOR = 4
+
+class OffScheduler:
+    # one deadline per key (a LightController) in a heap, driven by a single coroutine.
+    # moving a deadline just pushes a new entry, the old one is skipped when it surfaces,
+    # so continuous motion costs an O(log n) push per event and no task churn
+    def __init__(self):
+        self._heap = []
+        self._deadlines = dict()
+        self._callbacks = dict()
+        self._seq = 0
+        self._driver = None
+        self._wake = None
+        self._fire_tasks = set()
+
+        self.scheduled = 0
+        self.fired = 0
+
+    def deadline(self, key) -> float:
+        return self._deadlines.get(key)
+
+    def schedule(self, key, delay: float, callback, extend_only: bool = True) -> float:
+        # callback() is called with no args when the deadline passes and should return a coroutine.
+        # with extend_only an existing later deadline is kept. returns the deadline in loop time
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + delay
+        current = self._deadlines.get(key)
+        if extend_only and current is not None and current >= deadline:
+            return current
+
+        self._deadlines[key] = deadline
+        self._callbacks[key] = callback
+        self._seq += 1
+        heapq.heappush(self._heap, (deadline, self._seq, key))
+        self.scheduled += 1
+
+        if len(self._heap) > COMPACT_FACTOR * max(1, len(self._deadlines)):
+            self._compact()
+
+        if self._driver is None or self._driver.done():
+            self._driver = asyncio.create_task(self._run())
+        elif self._heap[0][0] == deadline and self._wake and not self._wake.done():
+            # new earliest deadline, wake the driver to re-arm
+            self._wake.set_result(None)
+        return deadline
+
+    def cancel(self, key) -> None:
+        self._deadlines.pop(key, None)
+        self._callbacks.pop(key, None)
+
+    def _compact(self) -> None:
+        self._heap = [entry for entry in self._heap if self._deadlines.get(entry[2]) == entry[0]]
+        heapq.heapify(self._heap)
+
+    def _pop_expired(self, now: float) -> list:
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) != deadline:
+                # superseded or cancelled
+                continue
+            del self._deadlines[key]
+            expired.append(self._callbacks.pop(key))
+        return expired
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._deadlines:
+            expired = self._pop_expired(loop.time())
+            if expired:
+                self.fired += len(expired)
+                logger.debug("offscheduler::_run: firing %s expired deadlines", len(expired))
+                task = asyncio.create_task(self._fire(expired))
+                self._fire_tasks.add(task)
+                task.add_done_callback(self._fire_tasks.discard)
+                continue
+            if not self._heap:
+                break
+
+            self._wake = loop.create_future()
+            handle = loop.call_at(self._heap[0][0], self._wake_up, self._wake)
+            try:
+                await self._wake
+            finally:
+                handle.cancel()
+                self._wake = None
+
+    @staticmethod
+    def _wake_up(wake: asyncio.Future) -> None:
+        if not wake.done():
+            wake.set_result(None)
+
+    async def _fire(self, callbacks: list) -> None:
+        results = await asyncio.gather(*(callback() for callback in callbacks), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("offscheduler::_fire: error in scheduled callback: [%s]", result)
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._deadlines),
+            'heap': len(self._heap),
+            'scheduled': self.scheduled,
+            'fired': self.fired,
+        }
+
+def get_off_scheduler(ring: Ring) -> OffScheduler:
+    # one scheduler per Ring object, shared by every LightController on that account
+    scheduler = getattr(ring, 'off_scheduler', None)
+    if scheduler is None:
+        scheduler = OffScheduler()
+        ring.off_scheduler = scheduler
+    return scheduler
@@ -0,0 +1,167 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import asyncio
+import heapq
+import re
+import time
+from ring_doorbell import Ring, RingTimeout
+from util.metrics import registry
+
+# lower goes first. lights coming on are what people notice, everything else can wait
+PRIORITY_LIGHT_ON = 0
+PRIORITY_POLL = 1
+PRIORITY_REFRESH = 2
+PRIORITY_LIGHT_OFF = 2
+PRIORITY_KEEP_WARM = 3
+
+# requests per second and bucket size
+DEFAULT_RATE = 2.0
+DEFAULT_BURST = 5
+# after a 429/5xx everything pauses for the backoff, doubling up to the max, and the rate halves
+# down to DEFAULT_RATE / MIN_RATE_DIVISOR. each success wins back a tenth of the base rate
+INITIAL_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+MIN_RATE_DIVISOR = 8
+RECOVERY_STEP = 0.1
+
+QUEUE_WAIT = registry.histogram('ring_api_queue_wait_seconds', 'Time a Ring API call waited for the rate limiter')
+THROTTLED = registry.counter('ring_api_throttled_total', 'Ring API calls answered with 429/5xx or timed out')
+
+_STATUS_RE = re.compile(r'status code (\d{3})')
+
+def _throttle_status(e: Exception) -> int:
+    # ring_doorbell wraps the aiohttp error in a RingError, dig the status back out
+    if isinstance(e, RingTimeout):
+        return 0
+    status = getattr(e.__cause__, 'status', None)
+    if status is None:
+        match = _STATUS_RE.search(str(e))
+        status = int(match.group(1)) if match else None
+    if status is not None and (status == 429 or status >= 500):
+        return status
+    return None
+
+class RateLimiter:
+    # token bucket shared by every outbound Ring call, with waiters served by priority
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._backoff = INITIAL_BACKOFF
+        self._backoff_until = 0.0
+        self._waiters = []
+        self._seq = 0
+        self._dispatcher = None
+        # monotonic time the last call finished, how long the connection has been idle
+        self.last_call = time.monotonic()
+
+        self.calls = 0
+        self.queued = 0
+        self.throttled = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def acquire(self, priority: int = PRIORITY_REFRESH) -> None:
+        start = time.monotonic()
+        self._refill(start)
+        if not self._waiters and start >= self._backoff_until and self._tokens >= 1:
+            self._tokens -= 1
+            QUEUE_WAIT.observe(0.0)
+            return None
+
+        self.queued += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, waiter))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await waiter
+        finally:
+            QUEUE_WAIT.observe(time.monotonic() - start)
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            now = time.monotonic()
+            if now < self._backoff_until:
+                await asyncio.sleep(self._backoff_until - now)
+                continue
+            self._refill(now)
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            _, _, waiter = heapq.heappop(self._waiters)
+            if waiter.done():
+                # caller gave up while queued
+                continue
+            self._tokens -= 1
+            waiter.set_result(None)
+
+    async def call(self, priority: int, fn, *args, **kwargs):
+        result, _, _ = await self.timed_call(priority, fn, *args, **kwargs)
+        return result
+
+    async def timed_call(self, priority: int, fn, *args, **kwargs) -> tuple:
+        # call() that also returns how long fn itself took and how long the connection had been
+        # idle when it started, both from after the wait for a token, which QUEUE_WAIT covers
+        await self.acquire(priority)
+        self.calls += 1
+        start = time.monotonic()
+        idle = start - self.last_call
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            status = _throttle_status(e)
+            if status is not None:
+                self._on_throttled(status)
+            raise
+        finally:
+            self.last_call = time.monotonic()
+        self._on_success()
+        return result, time.monotonic() - start, idle
+
+    def _on_throttled(self, status: int) -> None:
+        self.throttled += 1
+        THROTTLED.inc()
+        self.rate = max(self.base_rate / MIN_RATE_DIVISOR, self.rate / 2)
+        self._backoff_until = time.monotonic() + self._backoff
+        logger.warning("ratelimiter::_on_throttled: status [%s], pausing [%.1f]s, rate now [%.2f]/s", status or 'timeout', self._backoff, self.rate)
+        self._backoff = min(MAX_BACKOFF, self._backoff * 2)
+
+    def _on_success(self) -> None:
+        self._backoff = INITIAL_BACKOFF
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * RECOVERY_STEP)
+
+    def set_base_rate(self, rate: float) -> None:
+        # e.g. from a reloaded config. a backed off rate stays backed off and recovers towards
+        # the new base on its own, it's only pulled straight down if the new base is lower
+        self.base_rate = rate
+        self.rate = min(self.rate, rate)
+
+    def stats(self) -> dict:
+        return {
+            'rate': round(self.rate, 2),
+            'calls': self.calls,
+            'queued': self.queued,
+            'waiting': len(self._waiters),
+            'throttled': self.throttled,
+        }
+
+def get_rate_limiter(ring: Ring, rate: float = None, burst: int = None) -> RateLimiter:
+    # one limiter per Ring object, shared by every LightController, the refresher and main
+    limiter = getattr(ring, 'rate_limiter', None)
+    if limiter is None:
+        limiter = RateLimiter(DEFAULT_RATE if rate is None else rate, DEFAULT_BURST if burst is None else burst)
+        ring.rate_limiter = limiter
+        registry.gauge('ring_api_rate', 'Current Ring API rate limit, requests per second', lambda: limiter.rate)
+    else:
+        if rate is not None:
+            limiter.set_base_rate(rate)
+        if burst is not None:
+            limiter.burst = burst
+    return limiter
@@ -1,83 +1,257 @@
 import asyncio
+import threading
 import time
 from util.logger import logging
 from ring_doorbell import Ring, RingEvent, RingEventKind
 from ring.lightcontroller import LightController
+from ring.lightgroup import LightGroup
+from util.metrics import registry
+from util.ttlcache import TTLCache
 
 logger = logging.getLogger('ring_automation')
 
-MAX_EVENTS = 20
+PUSH_DELAY = registry.histogram('ring_event_push_delay_seconds', 'RingEvent.now to on_event')
+EVENTS_IGNORED = registry.counter('ring_events_ignored_total', 'Events for devices without a LightController', 'device_name')
+EVENTS_OLD = registry.counter('ring_events_old_total', 'Events dropped for being older than MAX_EVENT_AGE', 'device_name')
+EVENTS_DUPLICATE = registry.counter('ring_events_duplicate_total', 'Updates to already processed events', 'device_name')
+EVENTS_DROPPED = registry.counter('ring_events_dropped_total', 'Events dropped because the device queue was full', 'device_name')
+EVENTS_COLLAPSED = registry.counter('ring_events_collapsed_total', 'Startup events superseded by a newer event for the same device and kind')
+
+# hard cap on remembered event ids, they normally age out via their expires_in first
+MAX_EVENTS = 1000
+# sometimes the Ring API seems to send us a flood of old events when we first sign in
+# so ignore anything older than this
+MAX_EVENT_AGE = 10
+# how long a motion event keeps a light on, unless its group says otherwise
+DEFAULT_LIGHT_DURATION = 30
+# per-device ingestion queue size, and what to do when it's full
+MAX_QUEUED_EVENTS = 100
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+# after the listener starts, hold events for up to this long (or until it goes quiet for
+# CATCH_UP_QUIET) and only pass on the newest per device and kind
+CATCH_UP_WINDOW = 3.0
+CATCH_UP_QUIET = 0.5
 
 class RingEventHandler:
     # lightcontrollers dict is keyed on the 'doorbot_id' (the device's numeric id)
-    # we can get the device name string (for logging) from the LightController
-    def __init__(self, ring: Ring, lightcontrollers: dict[str, LightController]):
+    # we can get the device name string (for logging) from the LightController
+    # groups maps a trigger camera's doorbot_id to the LightGroups it switches. a light
+    # without a group of its own is still switched by its own camera
+    def __init__(self, ring: Ring, lightcontrollers: dict[str, LightController],
+                 queue_size: int = MAX_QUEUED_EVENTS, overflow: str = OVERFLOW_DROP_OLDEST,
+                 groups: dict[int, list[LightGroup]] = None):
         logger.info("ringeventhandler::__init__")
         self.ring = ring
         self.lightcontrollers = lightcontrollers
-        self.processed_events = set()
-        # TODO make configurable. 30s default
-        self.light_duration = 30
+        self.groups = groups if groups is not None else dict()
+        self.processed_events = TTLCache(MAX_EVENTS)
+        # TODO make configurable. 30s default
+        self.light_duration = DEFAULT_LIGHT_DURATION
+
+        # on_event only queues, the per-device workers do the filtering and dedup
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self._loop = None
+        self._loop_thread = None
+        self._queues: dict[int, asyncio.Queue] = dict()
+        self._workers: dict[int, asyncio.Task] = dict()
+        self._light_tasks = set()
+        # (doorbot_id, kind) -> (event, received) while catching up, None otherwise
+        self._catch_up = None
+        self._catch_up_buffered = 0
+        self._catch_up_deadline = None
+        self._catch_up_handle = None
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    async def start(self) -> None:
+        # capture the loop once so on_event never has to look it up
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        registry.gauge('ring_event_queue_depth', 'Events waiting in the per-device queues', lambda: sum(q.qsize() for q in self._queues.values()))
+        logger.info("ringeventhandler::start: queue_size [%s] overflow [%s]", self.queue_size, self.overflow)
+
+    async def stop(self) -> None:
+        if self._catch_up_handle:
+            self._catch_up_handle.cancel()
+        for task in self._workers.values():
+            task.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
+        logger.info("ringeventhandler::stop: queue stats %s processed_events %s", self.queue_stats(), self.processed_events.stats())
+
+    def begin_catch_up(self) -> None:
+        # call before event_listener.start(), events are buffered until end_catch_up's window closes
+        self._catch_up = dict()
+        self._catch_up_buffered = 0
+
+    def end_catch_up(self, window: float = CATCH_UP_WINDOW) -> None:
+        # call once the listener has started, flushes after window or sooner if the flood stops
+        if self._catch_up is None:
+            return None
+        self._catch_up_deadline = self._loop.time() + window
+        self._arm_catch_up()
+
+    def _arm_catch_up(self) -> None:
+        if self._catch_up_deadline is None:
+            # still starting the listener, end_catch_up arms it
+            return None
+        if self._catch_up_handle:
+            self._catch_up_handle.cancel()
+        when = min(self._catch_up_deadline, self._loop.time() + CATCH_UP_QUIET)
+        self._catch_up_handle = self._loop.call_at(when, self._flush_catch_up)
+
+    def _buffer_catch_up(self, event: RingEvent, received: float) -> None:
+        self._catch_up_buffered += 1
+        key = (event.doorbot_id, event.kind)
+        current = self._catch_up.get(key)
+        if current is None or event.now >= current[0].now:
+            self._catch_up[key] = (event, received)
+        self._arm_catch_up()
+
+    def _flush_catch_up(self) -> None:
+        buffered, self._catch_up = self._catch_up, None
+        self._catch_up_deadline = self._catch_up_handle = None
+        now = time.time()
+        kept = stale = 0
+        for event, received in buffered.values():
+            if now - event.now > MAX_EVENT_AGE:
+                stale += 1
+                EVENTS_OLD.inc(event.device_name)
+                continue
+            kept += 1
+            self._enqueue(event, received)
+        collapsed = self._catch_up_buffered - len(buffered)
+        EVENTS_COLLAPSED.inc(amount=collapsed)
+        logger.info("ringeventhandler::_flush_catch_up: [%s] startup events collapsed to [%s], [%s] too old, [%s] passed on",
+                    self._catch_up_buffered, len(buffered), stale, kept)
 
-    def handle_event_id(self, event: RingEvent, new_event: bool) -> None:
-        logger.debug(f"ringeventhandler::handle_event_id: [{event.id}] new_event [{new_event}]")
-        asyncio.run_coroutine_threadsafe(self.lightcontrollers[event.doorbot_id].set_lights(True, self.light_duration), asyncio.get_event_loop())
+    def queue_stats(self) -> dict:
+        return {
+            'depth': sum(q.qsize() for q in self._queues.values()),
+            'max_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'overflow': self.overflow,
+        }
 
-    def evict_event_id(self, id) -> None:
-        if id in self.processed_events:
-            self.processed_events.pop(id)
-            logger.debug(f"ringeventhandler::evict_event_id: pop id [{id}] processed_events = {len(self.processed_events)}")
+    def handle_event_id(self, event: RingEvent, new_event: bool, received: float = None) -> None:
+        logger.debug("ringeventhandler::handle_event_id: [%s] new_event [%s]", event.id, new_event)
+        groups = self.groups.get(event.doorbot_id)
+        if groups:
+            coros = [group.set_lights(True, received) for group in groups]
+        else:
+            lc = self.lightcontrollers.get(event.doorbot_id)
+            if lc is None:
+                # controller was removed while the event was queued
+                return None
+            coros = [lc.set_lights(True, self.light_duration, received)]
+
+        # don't hold up the worker while the lights are switched and confirmed
+        for coro in coros:
+            task = asyncio.create_task(coro)
+            self._light_tasks.add(task)
+            task.add_done_callback(self._light_tasks.discard)
 
     def on_event(self, event: RingEvent) -> None:
-        logger.debug(f"ringeventhandler::on_event: [{event}]")
+        # called from the listener, keep this cheap and non-blocking
+        received = time.monotonic()
+        PUSH_DELAY.observe(time.time() - event.now)
+        if self._loop is None:
+            logger.warning("ringeventhandler::on_event: handler not started, dropping event [%s]", event.id)
+            return None
+        if threading.get_ident() == self._loop_thread:
+            self._enqueue(event, received)
+        else:
+            self._loop.call_soon_threadsafe(self._enqueue, event, received)
+
+    def _enqueue(self, event: RingEvent, received: float) -> None:
+        event_doorbot_id = event.doorbot_id
+        if event_doorbot_id not in self.lightcontrollers and event_doorbot_id not in self.groups:
+            EVENTS_IGNORED.inc(event.device_name)
+            logger.info("ringeventhandler::on_event: ignoring event for device_name [%s]", event.device_name)
+            return None
+        if self._catch_up is not None:
+            self._buffer_catch_up(event, received)
+            return None
+
+        queue = self._queues.get(event_doorbot_id)
+        if queue is None:
+            queue = asyncio.Queue(self.queue_size)
+            self._queues[event_doorbot_id] = queue
+            self._workers[event_doorbot_id] = asyncio.create_task(self._device_worker(event_doorbot_id, queue))
+
+        if queue.full():
+            self.dropped += 1
+            EVENTS_DROPPED.inc(event.device_name)
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                logger.warning("ringeventhandler::_enqueue: queue full for [%s], dropping event [%s] dropped [%s]", event.device_name, event.id, self.dropped)
+                return None
+            oldest, _ = queue.get_nowait()
+            queue.task_done()
+            logger.warning("ringeventhandler::_enqueue: queue full for [%s], dropping oldest event [%s] dropped [%s]", event.device_name, oldest.id, self.dropped)
+
+        queue.put_nowait((event, received))
+        self.enqueued += 1
+        if queue.qsize() > self.max_depth:
+            self.max_depth = queue.qsize()
+
+    async def _device_worker(self, doorbot_id: int, queue: asyncio.Queue) -> None:
+        logger.debug("ringeventhandler::_device_worker: started for [%s]", doorbot_id)
+        while True:
+            event, received = await queue.get()
+            try:
+                self.process_event(event, received)
+            finally:
+                queue.task_done()
+
+    def process_event(self, event: RingEvent, received: float = None) -> None:
+        logger.debug("ringeventhandler::process_event: [%s]", event)
 
-        # sometimes the Ring API seems to send us a flood of old events when we first sign in
-        # let's ignore stuff older than 10s ago
         current_time = time.time()
         event_time = event.now
         age_seconds = current_time - event_time
-        
-        if age_seconds > 10:
-            logger.debug(f"ringeventhandler::on_event: ignoring old event. age [{age_seconds:.1f}]s")
+
+        if age_seconds > MAX_EVENT_AGE:
+            EVENTS_OLD.inc(event.device_name)
+            logger.debug("ringeventhandler::process_event: ignoring old event. age [%.1f]s", age_seconds)
             return
 
         #callback function that gets called when Ring events occur.
-        # RingEventHandler::on_event: RingEvent(id=7581554843738829838, 
-        # doorbot_id=707916814, device_name='Drive', device_kind='cocoa_floodlight', 
+        # RingEventHandler::on_event: RingEvent(id=7581554843738829838,
+        # doorbot_id=707916814, device_name='Drive', device_kind='cocoa_floodlight',
         # now=1765218296.0, expires_in=180, kind='motion', state='vehicle', is_update=False)
         try:
-            event_doorbot_id = event.doorbot_id
-            if event_doorbot_id not in self.lightcontrollers:
-               logger.info(f"ringeventhandler::on_event: ignoring event for device_name [{event.device_name}]")
-               return None
-            
             event_id = event.id
             event_kind = event.kind
             event_state = event.state
 
-            logger.info(f"ringeventhandler::on_event: device_name [{event.device_name}] kind [{event_kind}] state [{event_state}] event_id: {event_id}")
+            logger.info("ringeventhandler::process_event: device_name [%s] kind [%s] state [%s] event_id: %s", event.device_name, event_kind, event_state, event_id)
 
             # handle only motion events since we're using this as a proxy for the PIR
             # logic should be:
-            # if new motion event (not in processed events), turn on lights for 30s
-            # if is_update=True and id in processed_events, extend lights on for extra 30s
-            # then set timer to evict processed events from cache using the 'expires_in' value
+            # if new motion event (not in processed events), turn on lights for 30s
+            # if is_update=True and id in processed_events, extend lights on for extra 30s
+            # processed events drop out of the cache once their 'expires_in' has passed
             if event_kind == RingEventKind.MOTION.value:
                 if event_id in self.processed_events:
-                    logger.info(f"ringeventhandler::on_event: Update to existing [{event_state}] motion detected on [{event.device_name}]")
+                    logger.info("ringeventhandler::process_event: Update to existing [%s] motion detected on [%s]", event_state, event.device_name)
+                    EVENTS_DUPLICATE.inc(event.device_name)
                     # extend lights
-                    self.handle_event_id(event, False)
-                    if len(self.processed_events > MAX_EVENTS):
-                        self.evict_event_id(event.id)
+                    self.handle_event_id(event, False, received)
                 else:
-                    logger.info(f"ringeventhandler::on_event: New [{event_state}] motion detected on [{event.device_name}]")
-                    self.processed_events.add(event_id)
-                    self.handle_event_id(event, True)
+                    logger.info("ringeventhandler::process_event: New [%s] motion detected on [%s]", event_state, event.device_name)
+                    self.processed_events.add(event_id, event.now + event.expires_in)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("ringeventhandler::process_event: processed_events %s", self.processed_events.stats())
+                    self.handle_event_id(event, True, received)
             # other event types blah, probably won't trigger on the floodlight actually
             else:
-                logger.info(f"ringeventhandler::on_event: Other event: [{event_kind}]")
-        
-        except Exception as e:
-            logger.error(f"ringeventhandler::on_event: Error handling event: [{e}]", exc_info=True)
-    
+                logger.info("ringeventhandler::process_event: Other event: [%s]", event_kind)
 
+        except Exception as e:
+            logger.error("ringeventhandler::process_event: Error handling event: [%s]", e, exc_info=True)
@@ -0,0 +1,140 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import asyncio
+import json
+import time
+from pathlib import Path
+from ring.lightcontroller import LightController
+from ring.ringeventhandler import RingEventHandler
+from util.atomicfile import write_json_atomic
+
+# how often the state is written, if it changed
+DEFAULT_SNAPSHOT_INTERVAL = 5.0
+
+def snapshot_state(event_handler: RingEventHandler, lightcontrollers: dict[int, LightController]) -> dict:
+    # what we need to pick up where we left off: the events we've already acted on, and for
+    # each light whether we last saw it on and when it's due off. times are epoch seconds
+    # since the scheduler's loop clock means nothing to the next process
+    loop_offset = time.time() - asyncio.get_running_loop().time()
+    lights = dict()
+    for device_id, lc in lightcontrollers.items():
+        if not lc.has_light:
+            continue
+        snapshot = lc.snapshot()
+        deadline = snapshot['off_deadline']
+        lights[str(device_id)] = {
+            'on': snapshot['on'],
+            'off_at': round(deadline + loop_offset, 3) if deadline is not None else None,
+        }
+    return {
+        'events': [[event_id, expires_at] for event_id, expires_at in event_handler.processed_events.items()],
+        'lights': lights,
+    }
+
+def write_state(state_file: Path, state: dict) -> None:
+    write_json_atomic(state_file, {'saved_at': time.time(), **state}, separators=(',', ':'))
+
+def load_state(state_file: Path) -> dict:
+    # None if there's no usable snapshot
+    state_file = Path(state_file)
+    if not state_file.is_file():
+        return None
+    try:
+        with open(state_file, encoding='utf-8') as f:
+            state = json.load(f)
+    except Exception as e:
+        logger.error("runtimestate::load_state: could not load [%s]: [%s]", state_file, e)
+        return None
+    if not isinstance(state, dict):
+        logger.error("runtimestate::load_state: [%s] isn't a state snapshot, ignoring it", state_file)
+        return None
+    return state
+
+def restore_state(state: dict, event_handler: RingEventHandler, lightcontrollers: dict[int, LightController]) -> None:
+    # call on the loop after the LightControllers exist and before the listener starts,
+    # so replayed events are deduped and lights left on are still turned off on time
+    # the file parsed but could be from another version or hand edited, so anything that
+    # isn't the shape we expect is skipped rather than stopping startup
+    now = time.time()
+    events = state.get('events')
+    lights = state.get('lights')
+    if not isinstance(events, list) or not isinstance(lights, dict):
+        logger.error("runtimestate::restore_state: unexpected snapshot layout, ignoring it")
+        return None
+
+    restored_events = 0
+    skipped = 0
+    for entry in events:
+        try:
+            event_id, expires_at = entry
+            expires_at = float(expires_at)
+        except (TypeError, ValueError):
+            skipped += 1
+            continue
+        if expires_at > now:
+            event_handler.processed_events.add(event_id, expires_at)
+            restored_events += 1
+
+    restored_offs = 0
+    for device_id, light in lights.items():
+        try:
+            lc = lightcontrollers.get(int(device_id))
+            off_at = light.get('off_at')
+            delay = max(0.0, float(off_at) - now) if off_at is not None else None
+            was_on = bool(light.get('on'))
+        except (AttributeError, TypeError, ValueError):
+            skipped += 1
+            continue
+        if lc is None or not lc.has_light or delay is None:
+            continue
+        # we had it on with an off pending, an overdue off fires straight away
+        lc.restore_off(delay, was_on)
+        restored_offs += 1
+
+    saved_at = state.get('saved_at')
+    logger.info("runtimestate::restore_state: restored %s events and %s off deadlines, skipped %s bad entries, saved [%s]s ago",
+                restored_events, restored_offs, skipped, round(now - saved_at, 1) if isinstance(saved_at, (int, float)) else None)
+
+class StateSaver:
+    # writes the runtime state every interval if it changed, and once more on stop
+    def __init__(self, state_file: Path, event_handler: RingEventHandler,
+                 lightcontrollers: dict[int, LightController], interval: float = DEFAULT_SNAPSHOT_INTERVAL):
+        self.state_file = Path(state_file)
+        self.event_handler = event_handler
+        self.lightcontrollers = lightcontrollers
+        self.interval = interval
+        self._last_state = None
+        self._task = None
+
+        self.writes = 0
+        self.skipped = 0
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        logger.info("runtimestate::start: saving to [%s] every [%s]s", self.state_file, self.interval)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.save()
+        logger.info("runtimestate::stop: writes [%s] skipped [%s]", self.writes, self.skipped)
+
+    async def save(self) -> None:
+        state = snapshot_state(self.event_handler, self.lightcontrollers)
+        if state == self._last_state:
+            self.skipped += 1
+            return None
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, write_state, self.state_file, state)
+        except Exception as e:
+            logger.error("runtimestate::save: could not write [%s]: [%s]", self.state_file, e)
+            return None
+        self._last_state = state
+        self.writes += 1
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.save()
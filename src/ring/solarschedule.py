@@ -0,0 +1,69 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import time
+from datetime import datetime, timedelta
+from astral import LocationInfo
+from astral.sun import sun
+import pytz
+
+class SolarSchedule:
+    # sunrise/sunset for one location, computed once per local day and then answered with
+    # plain timestamp comparisons. don't construct directly, use get_solar_schedule() so
+    # controllers at the same lat/lon/tz share one entry
+    def __init__(self, latitude: float, longitude: float, timezone):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timezone = timezone
+        self.location = LocationInfo(latitude=latitude, longitude=longitude)
+
+        self.date = None
+        self.sunrise = None
+        self.sunset = None
+        self.refreshes = 0
+        # epoch timestamps, refreshed at the next local midnight
+        self._sunrise_ts = 0.0
+        self._sunset_ts = 0.0
+        self._refresh_at = 0.0
+
+    @property
+    def key(self) -> tuple:
+        return (self.latitude, self.longitude, self.timezone.zone, self.date)
+
+    def _refresh(self) -> None:
+        now = datetime.now(self.timezone)
+        s = sun(self.location.observer, date=now.date(), tzinfo=self.timezone)
+
+        self.date = now.date()
+        self.sunrise = s['sunrise']
+        self.sunset = s['sunset']
+        self._sunrise_ts = self.sunrise.timestamp()
+        self._sunset_ts = self.sunset.timestamp()
+
+        # localize rather than replace() so we get the right offset across dst changes
+        midnight = self.timezone.localize(datetime.combine(self.date + timedelta(days=1), datetime.min.time()))
+        self._refresh_at = midnight.timestamp()
+        self.refreshes += 1
+
+        logger.debug("solarschedule::_refresh: %s sunrise [%s] sunset [%s]", self.key, self.sunrise.strftime('%H:%M'), self.sunset.strftime('%H:%M'))
+
+    def is_dark(self, now: float = None) -> bool:
+        if now is None:
+            now = time.time()
+        if now >= self._refresh_at:
+            self._refresh()
+        return now < self._sunrise_ts or now > self._sunset_ts
+
+# keyed on (lat, lon, tz), each entry holds the schedule for its current local date
+_schedules: dict[tuple, SolarSchedule] = dict()
+
+def get_solar_schedule(latitude: float, longitude: float, timezone) -> SolarSchedule:
+    if isinstance(timezone, str):
+        timezone = pytz.timezone(timezone)
+
+    key = (latitude, longitude, timezone.zone)
+    schedule = _schedules.get(key)
+    if schedule is None:
+        schedule = SolarSchedule(latitude, longitude, timezone)
+        _schedules[key] = schedule
+        logger.debug("solarschedule::get_solar_schedule: new schedule for %s, schedules = %s", key, len(_schedules))
+    return schedule
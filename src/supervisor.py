@@ -0,0 +1,233 @@
+from main import Account, config, log, run_account
+import asyncio
+import contextvars
+import multiprocessing
+import time
+from config import Config
+from ring_doorbell.const import USER_AGENT
+from util.async_logger import get_log_stats
+from util.loopmonitor import LoopMonitor
+from util.metrics import MetricsServer, merge_labelled, registry, set_account_label
+
+# runs every account in config.json's 'accounts' list, each with its own token/gcm caches,
+# listener and LightControllers, e.g.
+#   "accounts": [{"name": "home", "lights": ["Drive"]}, {"name": "farm", "lights": ["Yard"], "timezone": "Europe/Dublin"}]
+# anything not set on an account comes from the top level. supervisor.mode 'tasks' runs them
+# all on this loop, 'processes' runs one worker process per account. a new account needs
+# signing in once in 'tasks' mode first, worker processes can't prompt for a password or 2FA
+MODE_TASKS = 'tasks'
+MODE_PROCESSES = 'processes'
+MAX_RESTART_DELAY = 300.0
+# how often a worker process sends its health and metrics back
+WORKER_REPORT_INTERVAL = 5.0
+
+def make_account(name: str, standalone: bool = False) -> Account:
+    account_config = Config(account=name)
+    # default the user agent per account so the cache files don't collide
+    return Account(account_config, name, account_config.user_agent or f"{USER_AGENT}-{name}", standalone)
+
+async def run_with_restart(account: Account, restart_delay: float) -> None:
+    # keep the account running until its stop_event is set. a failure only restarts this
+    # account, with a growing delay, the others carry on
+    delay = restart_delay
+    while not account.stop_event.is_set():
+        try:
+            await run_account(account)
+        except Exception as e:
+            account.state = 'failed'
+            account.error = str(e)
+            log.error("supervisor::run_with_restart: [%s] failed: [%s]", account.name, e, exc_info=True)
+        if account.stop_event.is_set():
+            break
+
+        if account.state == 'stopped':
+            # it got as far as listening, so start the backoff again
+            delay = restart_delay
+        for lc in account.lc_dict.values():
+            lc.close()
+        # in place, anything still holding the dict from the last run sees it empty
+        account.lc_dict.clear()
+        account.event_handler = None
+        log.warning("supervisor::run_with_restart: [%s] %s, restarting in [%s]s", account.name, account.state, delay)
+        try:
+            await asyncio.wait_for(account.stop_event.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        delay = min(MAX_RESTART_DELAY, delay * 2)
+
+def _worker(name: str, stop, status_queue, restart_delay: float) -> None:
+    # entry point of a worker process
+    asyncio.run(_run_worker(name, stop, status_queue, restart_delay))
+
+async def _run_worker(name: str, stop, status_queue, restart_delay: float) -> None:
+    account = make_account(name)
+    account.stop_event = asyncio.Event()
+
+    async def report() -> None:
+        # send health and metrics back, and pass the supervisor's stop on to listen()
+        last_report = 0.0
+        while not stop.is_set():
+            if time.monotonic() - last_report >= WORKER_REPORT_INTERVAL:
+                status_queue.put((name, account.health(), registry.render()))
+                last_report = time.monotonic()
+            await asyncio.sleep(0.5)
+        account.stop_event.set()
+
+    reporter = asyncio.create_task(report())
+    try:
+        await run_with_restart(account, restart_delay)
+    finally:
+        reporter.cancel()
+        status_queue.put((name, account.health(), registry.render()))
+        log.info("supervisor::_run_worker: [%s] exiting, log stats %s", name, get_log_stats())
+
+class Supervisor:
+    def __init__(self, supervisor_config: Config):
+        self.config = supervisor_config
+        self.mode = supervisor_config.supervisor_mode
+        self.names = supervisor_config.accounts
+        self.restart_delay = supervisor_config.supervisor_restart_delay
+        self.accounts = dict()
+        self._account_tasks = []
+        self._tasks = []
+        # processes mode
+        self._context = multiprocessing.get_context('spawn')
+        self._stop = None
+        self._status = None
+        self._processes = dict()
+        self._reports = dict()
+        self._stopping = False
+
+    async def start(self) -> None:
+        if self.mode == MODE_PROCESSES:
+            self._stop = self._context.Event()
+            self._status = self._context.Queue()
+            for name in self.names:
+                self._start_process(name)
+            self._tasks.append(asyncio.create_task(self._collect()))
+        else:
+            for name in self.names:
+                account = make_account(name)
+                account.stop_event = asyncio.Event()
+                self.accounts[name] = account
+                # the account's task, and every task it starts, labels its metrics with its name
+                context = contextvars.copy_context()
+                context.run(set_account_label, name)
+                self._account_tasks.append(context.run(asyncio.create_task, run_with_restart(account, self.restart_delay)))
+        self._tasks.append(asyncio.create_task(self._log_health()))
+        log.info("supervisor::start: running %s as %s", self.names, self.mode)
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self.mode == MODE_PROCESSES:
+            self._stop.set()
+            loop = asyncio.get_running_loop()
+            for name, process in self._processes.items():
+                await loop.run_in_executor(None, process.join, 30)
+                if process.is_alive():
+                    log.warning("supervisor::stop: [%s] worker didn't stop, terminating", name)
+                    process.terminate()
+        else:
+            for account in self.accounts.values():
+                account.stop_event.set()
+            await asyncio.gather(*self._account_tasks, return_exceptions=True)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._drain()
+        log.info("supervisor::stop: final health %s", self.health())
+
+    def _start_process(self, name: str) -> None:
+        process = self._context.Process(target=_worker, args=(name, self._stop, self._status, self.restart_delay),
+                                        name=f"ring-{name}")
+        process.start()
+        self._processes[name] = process
+
+    def _drain(self) -> None:
+        if self._status is None:
+            return None
+        while True:
+            try:
+                name, health, metrics = self._status.get_nowait()
+            except Exception:
+                return None
+            self._reports[name] = (health, metrics, time.monotonic())
+
+    async def _collect(self) -> None:
+        # pull worker reports off the queue and restart any worker process that died. the
+        # accounts restart themselves inside their worker, this is for the process going
+        delay = dict()
+        while True:
+            self._drain()
+            for name, process in list(self._processes.items()):
+                if process.is_alive() or self._stopping:
+                    continue
+                wait = delay.get(name, self.restart_delay)
+                log.error("supervisor::_collect: [%s] worker exited with [%s], restarting in [%s]s", name, process.exitcode, wait)
+                self._processes.pop(name)
+                delay[name] = min(MAX_RESTART_DELAY, wait * 2)
+                asyncio.get_running_loop().call_later(wait, self._restart_process, name)
+            await asyncio.sleep(1.0)
+
+    def _restart_process(self, name: str) -> None:
+        if not self._stopping:
+            self._start_process(name)
+
+    def health(self) -> list[dict]:
+        if self.mode != MODE_PROCESSES:
+            return [account.health() for account in self.accounts.values()]
+        health = []
+        now = time.monotonic()
+        for name in self.names:
+            report = self._reports.get(name)
+            entry = dict(report[0]) if report else {'account': name, 'state': 'starting'}
+            entry['alive'] = name in self._processes and self._processes[name].is_alive()
+            entry['report_age'] = round(now - report[2], 1) if report else None
+            health.append(entry)
+        return health
+
+    def render(self) -> str:
+        # tasks share this process's registry, with each account's samples labelled by the
+        # account its task set (see start). worker processes each send their own, labelled here
+        if self.mode == MODE_PROCESSES:
+            text = merge_labelled({name: report[1] for name, report in self._reports.items()}, 'account')
+        else:
+            text = registry.render()
+        lines = ['# HELP ring_account_up Account is listening for events', '# TYPE ring_account_up gauge']
+        for entry in self.health():
+            lines.append(f'ring_account_up{{account="{entry["account"]}"}} {1 if entry["state"] == "listening" else 0}')
+        return text + '\n'.join(lines) + '\n'
+
+    async def _log_health(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.supervisor_health_interval)
+            for entry in self.health():
+                log.info("supervisor::_log_health: %s", entry)
+
+async def supervise() -> None:
+    if not config.accounts:
+        raise SystemExit("supervisor: no 'accounts' in config.json, run main.py for a single account")
+    supervisor = Supervisor(config)
+
+    loop_monitor = None
+    if config.diagnostics_enabled:
+        loop_monitor = LoopMonitor(config.diagnostics_lag_interval, config.diagnostics_slow_callback, config.diagnostics_report_interval)
+        await loop_monitor.start()
+    metrics_server = None
+    if config.metrics_enabled:
+        metrics_server = MetricsServer(config.metrics_host, config.metrics_port, supervisor, supervisor.health)
+        await metrics_server.start()
+
+    await supervisor.start()
+    print("supervisor: running, press enter to stop...")
+    await asyncio.get_running_loop().run_in_executor(None, input)
+    await supervisor.stop()
+
+    if metrics_server:
+        await metrics_server.stop()
+    if loop_monitor:
+        await loop_monitor.stop()
+    log.info("supervisor::supervise: Clean shutdown, log stats %s", get_log_stats())
+
+if __name__ == "__main__":
+    asyncio.run(supervise())
@@ -1,81 +1,186 @@
 import logging
 from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from datetime import datetime
-from queue import Queue
+from datetime import datetime, timedelta
+from queue import Queue, Full, Empty
 import atexit
+import json
+
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_SAMPLE = 'sample'
+# when sampling, once the queue is this full only 1 in SAMPLE_RATE records below WARNING get through
+SAMPLE_HIGH_WATER = 0.5
+SAMPLE_RATE = 10
 
 class AsyncLoggerAdapter(logging.Logger):
     custom_logger = None
-    
+
     def _log(self, level, msg, args, exc_info=None, extra=None, stack_info=False, stacklevel=1):
         if self.custom_logger is None:
             super()._log(level, msg, args, exc_info, extra, stack_info, stacklevel)
             return
-        
-        if args:
-            msg = msg % args
-        
+
         if level >= logging.ERROR:
-            self.custom_logger.error(msg)
+            level = logging.ERROR
         elif level >= logging.WARNING:
-            self.custom_logger.warning(msg)
+            level = logging.WARNING
         elif level >= logging.INFO:
-            self.custom_logger.info(msg)
+            level = logging.INFO
         else:
-            self.custom_logger.debug(msg)
+            level = logging.DEBUG
+
+        # only records that pass the level check are formatted, in BoundedQueueHandler.emit
+        if self.custom_logger.isEnabledFor(level):
+            self.custom_logger._log(level, msg, args, exc_info=exc_info, extra=extra, stack_info=stack_info)
+
+class BoundedQueueHandler(QueueHandler):
+    # never blocks the caller. when the queue is full either the oldest record is thrown
+    # away (drop_oldest) or, from SAMPLE_HIGH_WATER up, only a sample of the chatty
+    # records are kept and anything that still doesn't fit is dropped (sample)
+    def __init__(self, queue: Queue, overflow: str = OVERFLOW_DROP_OLDEST):
+        super().__init__(queue)
+        self.overflow = overflow
+        self.dropped = 0
+        self.sampled_out = 0
+        self._sample_counter = 0
+        self._high_water = int(queue.maxsize * SAMPLE_HIGH_WATER)
+
+    def emit(self, record):
+        # the stdlib prepare() formats msg % args (and any traceback) here on the caller's
+        # thread, so the record doesn't hold on to objects the loop goes on changing. that
+        # only happens for records that got past the level check, and is skipped for the
+        # ones sampling throws away
+        if self.overflow == OVERFLOW_SAMPLE and record.levelno < logging.WARNING and self.queue.qsize() >= self._high_water:
+            self._sample_counter += 1
+            if self._sample_counter % SAMPLE_RATE:
+                self.sampled_out += 1
+                return None
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return None
+        except Full:
+            pass
+
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                pass
+            self.dropped += 1
+            try:
+                self.queue.put_nowait(record)
+            except Full:
+                self.dropped += 1
+        else:
+            self.dropped += 1
+
+class DailyFileHandler(logging.FileHandler):
+    # writes to log_dir/YYYY-MM-DD.log and moves on to the next day's file at local midnight
+    def __init__(self, log_dir: Path, encoding='utf-8'):
+        self.log_dir = Path(log_dir)
+        self._next_rollover = 0.0
+        super().__init__(self._current_file(), encoding=encoding)
+
+    def _current_file(self) -> Path:
+        today = datetime.now()
+        tomorrow = datetime.combine(today.date() + timedelta(days=1), datetime.min.time())
+        self._next_rollover = tomorrow.timestamp()
+        return self.log_dir / f"{today.strftime('%Y-%m-%d')}.log"
+
+    def emit(self, record):
+        if record.created >= self._next_rollover:
+            self.acquire()
+            try:
+                if self.stream:
+                    self.stream.close()
+                    self.stream = None
+                # FileHandler reopens baseFilename lazily on the next emit
+                self.baseFilename = str(self._current_file().absolute())
+            finally:
+                self.release()
+        super().emit(record)
+
+class JsonFormatter(logging.Formatter):
+    # one compact json object per line
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(',', ':'), default=str)
 
 # Global queue listener reference for cleanup
 _queue_listener = None
+_queue_handler = None
+
+def get_log_stats() -> dict:
+    if _queue_handler is None:
+        return {}
+    return {
+        'queued': _queue_handler.queue.qsize(),
+        'dropped': _queue_handler.dropped,
+        'sampled_out': _queue_handler.sampled_out,
+    }
+
+def setup_logger(name='logger', log_dir='logs', level=logging.INFO, console=True,
+                 queue_size=10000, overflow=OVERFLOW_DROP_OLDEST, json_format=False):
+    global _queue_listener, _queue_handler
 
-def setup_logger(name='logger', log_dir='logs', level=logging.INFO, console=True):
-    global _queue_listener
-    
     log_path = Path(log_dir)
     log_path.mkdir(exist_ok=True)
-    
+
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    
+
     # return existing logger if already configured (we want a singleton)
     if logger.handlers:
         return logger
-    
-    # daily log file names
-    log_file = log_path / f"{datetime.now().strftime('%Y-%m-%d')}.log"
-    
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+
+    # daily log file names, rolled over at midnight
+    file_handler = DailyFileHandler(log_path, encoding='utf-8')
     file_handler.setLevel(level)
 
-    # 2025-10-12 14:15:16.178 - INFO - blah
-    formatter = logging.Formatter(
-        '%(asctime)s.%(msecs)03d - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        # 2025-10-12 14:15:16.178 - INFO - blah
+        formatter = logging.Formatter(
+            '%(asctime)s.%(msecs)03d - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
     file_handler.setFormatter(formatter)
     handlers = [file_handler]
-    
+
     if console:
         console_handler = logging.StreamHandler()
         console_handler.setLevel(level)
         console_handler.setFormatter(formatter)
         handlers.append(console_handler)
-    
-    log_queue = Queue(-1)  # TODO maybe cap this size
-    queue_handler = QueueHandler(log_queue)
-    
+
+    log_queue = Queue(queue_size)
+    _queue_handler = BoundedQueueHandler(log_queue, overflow)
+
     _queue_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
     _queue_listener.start()
-    
+
     # only have queue as handler
-    logger.addHandler(queue_handler)
-    
+    logger.addHandler(_queue_handler)
+
     # make sure we get all logging
     logging.setLoggerClass(AsyncLoggerAdapter)
     AsyncLoggerAdapter.custom_logger = logger
     logging.root.setLevel(logging.DEBUG)
-    
+
     # Ensure listener stops on program exit
     atexit.register(_queue_listener.stop)
-    
+
     return logger
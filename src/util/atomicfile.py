@@ -0,0 +1,21 @@
+import json
+import os
+from pathlib import Path
+
+def write_json_atomic(path: Path, value, **dump_kwargs) -> None:
+    # write to a temp file next to path, fsync it and rename it over path, then fsync the
+    # directory so the rename itself survives a crash. either the old file or the whole new
+    # one is there afterwards, never a truncated one
+    path = Path(path)
+    tmp_file = path.with_name(path.name + '.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(value, f, **dump_kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+    if os.name == 'posix':
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
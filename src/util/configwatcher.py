@@ -0,0 +1,67 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import asyncio
+import os
+from config import Config
+
+# seconds between checks of config.json
+DEFAULT_CHECK_INTERVAL = 2.0
+
+class ConfigWatcher:
+    # polls config.json's mtime and size, which is one stat() per interval, and only
+    # re-reads the file when they change. on_change() is called (on the loop) after the
+    # Config has been updated in place
+    def __init__(self, config: Config, on_change, interval: float = DEFAULT_CHECK_INTERVAL):
+        self.config = config
+        self.on_change = on_change
+        self.interval = interval
+        self._signature = self._stat()
+        self._task = None
+
+        self.reloads = 0
+        self.errors = 0
+
+    def _stat(self) -> tuple:
+        try:
+            stat = os.stat(self.config.config_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        logger.info("configwatcher::start: watching [%s] every [%s]s", self.config.config_path, self.interval)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        logger.info("configwatcher::stop: reloads [%s] errors [%s]", self.reloads, self.errors)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+            self.check()
+
+    def check(self) -> None:
+        try:
+            changed = self.config.reload()
+        except Exception as e:
+            # probably caught half way through an edit, the next save will have a new mtime
+            self.errors += 1
+            logger.error("configwatcher::check: could not reload [%s], keeping the running config: [%s]", self.config.config_path, e)
+            return None
+        if not changed:
+            return None
+        self.reloads += 1
+        logger.info("configwatcher::check: [%s] changed, applying", self.config.config_path)
+        try:
+            self.on_change()
+        except Exception as e:
+            self.errors += 1
+            logger.error("configwatcher::check: error applying config: [%s]", e, exc_info=True)
@@ -0,0 +1,83 @@
+import asyncio
+import json
+from pathlib import Path
+from util.atomicfile import write_json_atomic
+from util.logger import logging
+
+logger = logging.getLogger('ring_automation')
+
+# how long to wait for more updates before writing
+DEFAULT_DEBOUNCE = 1.0
+
+class CredentialStore:
+    # keeps a json credential (auth token, GCM credentials) in memory and writes it off the
+    # event loop. updates within the debounce window are coalesced into one write, and the
+    # write goes to a temp file that's synced and renamed over the old one so a crash mid
+    # write leaves the previous credentials rather than a truncated file
+    def __init__(self, path: Path, debounce: float = DEFAULT_DEBOUNCE):
+        self.path = Path(path)
+        self.debounce = debounce
+        self.value = None
+        self._dirty = False
+        self._handle = None
+        self._flush_task = None
+
+        self.updates = 0
+        self.writes = 0
+
+    def exists(self) -> bool:
+        return self.value is not None or self.path.is_file()
+
+    def load(self):
+        # None if there's nothing saved
+        if self.value is None and self.path.is_file():
+            with open(self.path, encoding='utf-8') as f:
+                self.value = json.load(f)
+        return self.value
+
+    def update(self, value) -> None:
+        # safe to call from a sync callback on the loop, or from another thread
+        self.value = value
+        self._dirty = True
+        self.updates += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            # no loop in this thread, nothing to stall
+            self._write(value)
+            self._dirty = False
+            return None
+        if self._handle is None:
+            self._handle = loop.call_later(self.debounce, self._schedule_flush)
+
+    def _schedule_flush(self) -> None:
+        self._handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush())
+        else:
+            # a write is in progress, go again once it's done
+            self._handle = asyncio.get_running_loop().call_later(self.debounce, self._schedule_flush)
+
+    async def flush(self) -> None:
+        # write now if there's anything unsaved, e.g. on shutdown
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        if self._flush_task and not self._flush_task.done() and self._flush_task is not asyncio.current_task():
+            await self._flush_task
+        if not self._dirty:
+            return None
+        value = self.value
+        self._dirty = False
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, value)
+        except Exception as e:
+            self._dirty = True
+            logger.error("credentialstore::flush: could not write [%s]: [%s]", self.path, e)
+
+    def _write(self, value) -> None:
+        write_json_atomic(self.path, value)
+        self.writes += 1
+        logger.debug("credentialstore::_write: saved [%s] updates [%s] writes [%s]", self.path, self.updates, self.writes)
@@ -0,0 +1,165 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from util.metrics import registry
+
+# how often the loop is sampled for lag, what counts as a slow callback and how often
+# the per-coroutine summary is logged, all seconds
+DEFAULT_LAG_INTERVAL = 0.5
+DEFAULT_SLOW_CALLBACK = 0.1
+DEFAULT_REPORT_INTERVAL = 60.0
+# coroutines listed in each summary
+REPORT_TOP = 10
+
+LOOP_LAG = registry.histogram('loop_lag_seconds', 'How late the loop ran a callback scheduled by the lag monitor',
+                              buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+SLOW_CALLBACKS = registry.counter('loop_slow_callbacks_total', 'Loop callbacks that ran longer than the slow callback threshold')
+
+def _describe(handle: asyncio.Handle) -> str:
+    # task steps show up as the task's coroutine, anything else as the callback itself
+    callback = handle._callback
+    owner = getattr(callback, '__self__', None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return getattr(coro, '__qualname__', repr(coro))
+    return getattr(callback, '__qualname__', repr(callback))
+
+class LoopMonitor:
+    # diagnostic mode, turned on in config.json. three parts:
+    # - a loop callback every lag_interval measures how late it ran
+    # - every Handle._run is timed per coroutine/callback name, anything over slow_callback is logged
+    # - a watchdog thread grabs the loop thread's stack while a callback is still running past
+    #   slow_callback, which is what actually shows the blocking line rather than just the
+    #   coroutine it was in
+    def __init__(self, lag_interval: float = DEFAULT_LAG_INTERVAL, slow_callback: float = DEFAULT_SLOW_CALLBACK,
+                 report_interval: float = DEFAULT_REPORT_INTERVAL):
+        self.lag_interval = lag_interval
+        self.slow_callback = slow_callback
+        self.report_interval = report_interval
+        self._loop = None
+        self._loop_thread_id = None
+        self._original_run = None
+        self._tasks = []
+        self._watchdog = None
+        self._stopping = threading.Event()
+        # (handle, perf_counter start) of the callback the loop thread is running, read by the watchdog
+        self._current = None
+        # name -> [count, total seconds, max seconds] since the last report
+        self._timings = dict()
+
+        # lag since the last report
+        self.max_lag = 0.0
+        self._lag_total = 0.0
+        self._lag_samples = 0
+        self.slow_callbacks = 0
+        self.stalls = 0
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._install()
+        self._tasks = [asyncio.create_task(self._sample_lag()), asyncio.create_task(self._report())]
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+        logger.info("loopmonitor::start: lag interval [%s]s slow callback [%s]s report every [%s]s",
+                    self.lag_interval, self.slow_callback, self.report_interval)
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._uninstall()
+        self.log_summary()
+
+    def _install(self) -> None:
+        # wrap Handle._run (TimerHandle inherits it) for the whole process, undone in stop()
+        monitor = self
+        original_run = self._original_run = asyncio.Handle._run
+
+        def _timed_run(handle):
+            if threading.get_ident() != monitor._loop_thread_id:
+                # some other loop, e.g. one in an executor thread
+                return original_run(handle)
+            start = time.perf_counter()
+            previous, monitor._current = monitor._current, (handle, start)
+            try:
+                return original_run(handle)
+            finally:
+                monitor._current = previous
+                monitor._record(handle, time.perf_counter() - start)
+
+        asyncio.Handle._run = _timed_run
+
+    def _uninstall(self) -> None:
+        if self._original_run is not None:
+            asyncio.Handle._run = self._original_run
+            self._original_run = None
+
+    def _record(self, handle: asyncio.Handle, elapsed: float) -> None:
+        name = _describe(handle)
+        timing = self._timings.get(name)
+        if timing is None:
+            self._timings[name] = [1, elapsed, elapsed]
+        else:
+            timing[0] += 1
+            timing[1] += elapsed
+            if elapsed > timing[2]:
+                timing[2] = elapsed
+        if elapsed > self.slow_callback:
+            self.slow_callbacks += 1
+            SLOW_CALLBACKS.inc()
+            logger.warning("loopmonitor::_record: slow callback [%s] took [%.3f]s", name, elapsed)
+
+    async def _sample_lag(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, loop.time() - expected)
+            LOOP_LAG.observe(lag)
+            self._lag_total += lag
+            self._lag_samples += 1
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def _watch(self) -> None:
+        # runs in its own thread. once the callback the loop is running has taken longer than
+        # slow_callback, log where the loop thread is, once per callback
+        reported = None
+        while not self._stopping.wait(self.slow_callback / 2):
+            current = self._current
+            if current is None or current is reported:
+                continue
+            handle, start = current
+            running = time.perf_counter() - start
+            if running < self.slow_callback:
+                continue
+            reported = current
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self.stalls += 1
+            stack = ''.join(traceback.format_stack(frame))
+            logger.warning("loopmonitor::_watch: [%s] blocking the loop for [%.3f]s so far, loop thread stack:\n%s",
+                           _describe(handle), running, stack)
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.log_summary()
+
+    def log_summary(self) -> None:
+        timings, self._timings = self._timings, dict()
+        top = sorted(timings.items(), key=lambda item: item[1][1], reverse=True)[:REPORT_TOP]
+        logger.info("loopmonitor::log_summary: lag max [%.3f]s mean [%.4f]s slow callbacks [%s] stalls [%s]",
+                    self.max_lag, self._lag_total / self._lag_samples if self._lag_samples else 0.0, self.slow_callbacks, self.stalls)
+        for name, (count, total, longest) in top:
+            logger.info("loopmonitor::log_summary: [%s] calls [%s] total [%.3f]s mean [%.4f]s max [%.3f]s",
+                        name, count, total, total / count, longest)
+        self.max_lag = self._lag_total = 0.0
+        self._lag_samples = 0
@@ -0,0 +1,232 @@
+from util.logger import logging
+logger = logging.getLogger('ring_automation')
+import asyncio
+import contextvars
+import json
+from bisect import bisect_left
+
+# seconds, tuned for the 10ms - 10s range the event -> light path lives in
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# the account a sample belongs to when the supervisor runs several accounts as tasks in one
+# process. set on each account's task, every task it starts inherits it, so the hot path
+# doesn't have to pass it around. None (a single account, or a worker process) leaves it off
+account_label = contextvars.ContextVar('metrics_account', default=None)
+
+def set_account_label(name: str) -> None:
+    account_label.set(name)
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+def _account_labels(account: str) -> dict:
+    return {'account': account} if account is not None else {}
+
+class Counter:
+    # optionally split by one label, e.g. device_name
+    def __init__(self, name: str, help: str, label: str = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        # (account, label_value) -> value
+        self._values = dict()
+
+    def inc(self, label_value=None, amount: float = 1) -> None:
+        key = (account_label.get(), label_value)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, label_value=None) -> float:
+        # for the current account
+        return self._values.get((account_label.get(), label_value), 0)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for (account, label_value), value in self._values.items():
+            labels = _account_labels(account)
+            if self.label:
+                labels[self.label] = label_value
+            lines.append(f'{self.name}{_format_labels(labels)} {value}')
+        return lines
+
+class Gauge:
+    # value is read from fn when rendered, so there's nothing to update on the hot path.
+    # one fn per account, the last registered for an account wins
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._fns = dict()
+
+    def set_fn(self, fn) -> None:
+        self._fns[account_label.get()] = fn
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for account, fn in self._fns.items():
+            lines.append(f'{self.name}{_format_labels(_account_labels(account))} {fn()}')
+        return lines
+
+class _HistogramSeries:
+    def __init__(self, buckets: int):
+        # one slot per bucket plus +Inf, cumulated at render time
+        self.counts = [0] * (buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # account -> _HistogramSeries
+        self._series = dict()
+
+    def _get_series(self) -> _HistogramSeries:
+        account = account_label.get()
+        series = self._series.get(account)
+        if series is None:
+            series = self._series[account] = _HistogramSeries(len(self.buckets))
+        return series
+
+    def observe(self, value: float) -> None:
+        series = self._get_series()
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.count += 1
+        series.sum += value
+
+    @property
+    def count(self) -> int:
+        return self._get_series().count
+
+    @property
+    def sum(self) -> float:
+        return self._get_series().sum
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for account, series in self._series.items():
+            labels = _account_labels(account)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels({**labels, "le": bound})} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {series.sum}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {series.count}')
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = dict()
+
+    def _get_or_add(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label: str = None) -> Counter:
+        return self._get_or_add(Counter(name, help, label))
+
+    def histogram(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_add(Histogram(name, help, buckets))
+
+    def gauge(self, name: str, help: str, fn) -> Gauge:
+        # last registration (for the current account) wins so a rebuilt object can point the gauge at itself
+        gauge = self._get_or_add(Gauge(name, help))
+        gauge.set_fn(fn)
+        return gauge
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.error("metrics::render: error rendering [%s]: [%s]", metric.name, e)
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+def add_label(text: str, name: str, value: str) -> str:
+    # add name="value" to every sample in rendered text, e.g. to tell worker processes apart
+    label = f'{name}="{value}"'
+    lines = []
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            lines.append(line)
+        elif '{' in line:
+            metric, rest = line.split('{', 1)
+            lines.append(f'{metric}{{{label},{rest}')
+        else:
+            metric, rest = line.split(' ', 1)
+            lines.append(f'{metric}{{{label}}} {rest}')
+    return '\n'.join(lines) + '\n'
+
+def merge_labelled(texts: dict[str, str], name: str) -> str:
+    # merge rendered text from several registries into one exposition, each labelled with
+    # name="<its key>" and with every metric's samples kept together under one HELP/TYPE
+    families = dict()
+    for value, text in texts.items():
+        family = None
+        for line in add_label(text, name, value).splitlines():
+            if line.startswith('#'):
+                family = families.setdefault(line.split()[2], ([], []))
+                if line not in family[0]:
+                    family[0].append(line)
+            elif line and family is not None:
+                family[1].append(line)
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header)
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+class MetricsServer:
+    # tiny local http endpoint serving the registry in prometheus text format on /metrics,
+    # and health_fn() as json on /health if given
+    def __init__(self, host: str = '127.0.0.1', port: int = 9101, metrics_registry: MetricsRegistry = None, health_fn=None):
+        self.host = host
+        self.port = port
+        self.registry = metrics_registry or registry
+        self.health_fn = health_fn
+        self._server = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("metrics::start: serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            # drain the headers, we don't need any of them
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?')[0] if len(parts) >= 2 and parts[0] == 'GET' else None
+            if path == '/metrics':
+                status, body = '200 OK', self.registry.render().encode('utf-8')
+            elif path == '/health' and self.health_fn:
+                status, body = '200 OK', (json.dumps(self.health_fn()) + '\n').encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'not found\n'
+
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: close\r\n\r\n'.encode('latin-1') + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error("metrics::_handle: error serving request: [%s]", e)
+        finally:
+            writer.close()
@@ -0,0 +1,77 @@
+import heapq
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    # bounded set-like cache, each key carries its own expiry (epoch seconds).
+    # expired keys are dropped lazily on lookup and, in expiry order, on insert.
+    # when the cache is full the least recently used key goes. lookups are O(1), inserts
+    # O(log n) for the expiry heap
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        # (expires_at, key) in expiry order, separate from _entries as that's in use order.
+        # can hold stale pairs for keys that were re-added, evicted or expired on lookup,
+        # they're skipped when they surface
+        self._expiry = []
+
+        self.inserts = 0
+        self.hits = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        expires_at = self._entries.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.expired += 1
+            return False
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def add(self, key, expires_at: float) -> None:
+        now = time.time()
+        self._purge_expired(now)
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self._entries[key] = expires_at
+        heapq.heappush(self._expiry, (expires_at, key))
+        self.inserts += 1
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+        # stale pairs outnumber live entries, rebuild from what's left
+        if len(self._expiry) > 2 * self.max_size:
+            self._expiry = [(expires_at, key) for key, expires_at in self._entries.items()]
+            heapq.heapify(self._expiry)
+
+    def items(self) -> list[tuple]:
+        # live (key, expires_at) pairs, least recently used first
+        now = time.time()
+        return [(key, expires_at) for key, expires_at in self._entries.items() if expires_at > now]
+
+    def _purge_expired(self, now: float) -> None:
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            if self._entries.get(key) == expires_at:
+                del self._entries[key]
+                self.expired += 1
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'inserts': self.inserts,
+            'hits': self.hits,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the modules import each other as top level packages from src, same as running src/main.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
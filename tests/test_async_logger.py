@@ -0,0 +1,38 @@
+import logging
+import sys
+from queue import Queue
+from util.async_logger import OVERFLOW_SAMPLE, BoundedQueueHandler
+
+def make_record(msg, args, exc_info=None):
+    return logging.LogRecord('test', logging.ERROR, __file__, 1, msg, args, exc_info)
+
+def test_formats_on_the_callers_thread():
+    handler = BoundedQueueHandler(Queue(10))
+    stats = {'a': 1}
+    handler.emit(make_record("stats %s", (stats,)))
+    # changing it afterwards doesn't change what was logged
+    stats['b'] = 2
+    record = handler.queue.get_nowait()
+    assert record.getMessage() == "stats {'a': 1}"
+    assert record.args is None
+
+def test_drops_exc_info_keeping_the_traceback_text():
+    handler = BoundedQueueHandler(Queue(10))
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        handler.emit(make_record("failed", (), sys.exc_info()))
+    record = handler.queue.get_nowait()
+    assert record.exc_info is None
+    assert 'ValueError: boom' in record.getMessage()
+
+def test_sampled_out_records_are_not_formatted():
+    handler = BoundedQueueHandler(Queue(4), OVERFLOW_SAMPLE)
+    calls = []
+    handler.prepare = lambda record: calls.append(record) or record
+    for i in range(20):
+        record = make_record("debug %s", (i,))
+        record.levelno = logging.DEBUG
+        handler.emit(record)
+    assert handler.sampled_out > 0
+    assert len(calls) == 20 - handler.sampled_out
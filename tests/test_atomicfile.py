@@ -0,0 +1,18 @@
+import json
+import os
+from util.atomicfile import write_json_atomic
+
+def test_write_replaces_and_leaves_no_temp_file(tmp_path):
+    path = tmp_path / 'state.cache'
+    write_json_atomic(path, {'a': 1})
+    write_json_atomic(path, {'a': 2}, separators=(',', ':'))
+    assert json.loads(path.read_text(encoding='utf-8')) == {'a': 2}
+    assert os.listdir(tmp_path) == ['state.cache']
+
+def test_fsyncs_before_rename(tmp_path, monkeypatch):
+    calls = []
+    real_fsync, real_replace = os.fsync, os.replace
+    monkeypatch.setattr(os, 'fsync', lambda fd: (calls.append('fsync'), real_fsync(fd)))
+    monkeypatch.setattr(os, 'replace', lambda src, dst: (calls.append('replace'), real_replace(src, dst)))
+    write_json_atomic(tmp_path / 'devices.cache', [])
+    assert calls.index('fsync') < calls.index('replace')
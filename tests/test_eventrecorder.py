@@ -0,0 +1,26 @@
+import time
+from ring.eventrecorder import EventRecorder, load_capture
+from ring_doorbell import RingEvent, RingEventKind
+
+def make_event(event_id: int) -> RingEvent:
+    return RingEvent(id=event_id, doorbot_id=1, device_name='Drive', device_kind='cocoa_floodlight',
+                     now=time.time(), expires_in=180, kind=RingEventKind.MOTION.value, state='human')
+
+def test_records_everything_queued_by_close(tmp_path):
+    capture_file = tmp_path / 'events.jsonl'
+    recorder = EventRecorder(capture_file)
+    for i in range(100):
+        recorder.on_event(make_event(i))
+    recorder.close()
+    events = load_capture(capture_file)
+    assert [event.id for _, event in events] == list(range(100))
+    assert recorder.recorded == 100
+
+def test_on_event_does_not_write(tmp_path, monkeypatch):
+    recorder = EventRecorder(tmp_path / 'events.jsonl')
+    writes = []
+    monkeypatch.setattr(recorder._queue, 'put_nowait', lambda item: writes.append(item))
+    recorder.on_event(make_event(1))
+    # only queued, nothing written on the caller's thread
+    assert len(writes) == 1 and recorder.recorded == 0
+    recorder.close()
@@ -0,0 +1,44 @@
+import asyncio
+import time
+from ring.fakering import FakeRing
+from ring.keepwarm import KeepWarm
+from ring.lightcontroller import LightController
+
+class FakeAuth:
+    def __init__(self, expires_in: float):
+        self.token = {'expires_at': time.time() + expires_in}
+        self.refreshes = 0
+
+    async def async_refresh_tokens(self):
+        self.refreshes += 1
+        self.token = {'expires_at': time.time() + 3600}
+
+def make(dark: bool, expires_in: float = 3600):
+    ring = FakeRing({1: 'Drive'}, latency=0.0, lag=0.0)
+    ring.auth = FakeAuth(expires_in)
+    lc = LightController(ring, 'Drive', 'Europe/London')
+    lc.solar_schedule.is_dark = lambda: dark
+    return ring, KeepWarm(ring, {1: lc}, lambda: ring.auth.token, interval=30)
+
+def test_pings_and_refreshes_when_dark_and_idle():
+    async def run():
+        ring, kw = make(dark=True, expires_in=60)
+        kw.limiter.last_call -= 60
+        await kw.check()
+        assert ring.auth.refreshes == 1
+        assert ring.api_calls['get_device'] == 1
+        # the ping counts as use, so the next check has nothing to do
+        await kw.check()
+        assert ring.api_calls['get_device'] == 1
+        assert kw.stats()['skipped_busy'] == 1
+    asyncio.run(run())
+
+def test_does_nothing_while_light():
+    async def run():
+        ring, kw = make(dark=False, expires_in=60)
+        kw.limiter.last_call -= 60
+        await kw.check()
+        assert ring.auth.refreshes == 0
+        assert ring.api_calls['get_device'] == 0
+        assert kw.stats()['skipped_light'] == 1
+    asyncio.run(run())
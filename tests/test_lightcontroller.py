@@ -0,0 +1,32 @@
+import asyncio
+from ring.fakering import FakeRing
+from ring.lightcontroller import LightController
+
+def test_close_device_without_light():
+    async def run():
+        ring = FakeRing({1: 'Porch'}, latency=0.0, lag=0.0)
+        # a plain stick up cam has no light, so __init__ stops before the command loop state
+        for data in (ring._backend, ring.devices_data):
+            data['stickup_cams'][1]['kind'] = 'stickup_cam'
+        lc = LightController(ring, 'Porch', 'Europe/London')
+        assert not hasattr(lc, 'floodlight')
+        lc.close()
+    asyncio.run(run())
+
+def test_close_unknown_device():
+    async def run():
+        lc = LightController(FakeRing({1: 'Drive'}, latency=0.0, lag=0.0), 'Nowhere', 'Europe/London')
+        lc.close()
+    asyncio.run(run())
+
+def test_has_light():
+    async def run():
+        ring = FakeRing({1: 'Drive', 2: 'Porch'}, latency=0.0, lag=0.0)
+        for data in (ring._backend, ring.devices_data):
+            data['stickup_cams'][2]['kind'] = 'stickup_cam'
+        lights = [LightController(ring, name, 'Europe/London') for name in ('Drive', 'Porch', 'Nowhere')]
+        assert [lc.has_light for lc in lights] == [True, False, False]
+        assert not any(lc.is_on for lc in lights)
+        for lc in lights:
+            lc.close()
+    asyncio.run(run())
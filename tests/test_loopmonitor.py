@@ -0,0 +1,25 @@
+import asyncio
+import time
+from util.loopmonitor import LoopMonitor
+
+def blocking_callback():
+    time.sleep(0.3)
+
+def test_slow_callback_gets_a_stack(monkeypatch):
+    warnings = []
+    monkeypatch.setattr('util.loopmonitor.logger.warning', lambda msg, *args: warnings.append(msg % args))
+
+    async def run():
+        monitor = LoopMonitor(0.5, 0.1, 60.0)
+        await monitor.start()
+        asyncio.get_running_loop().call_soon(blocking_callback)
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+        return monitor
+    monitor = asyncio.run(run())
+
+    assert monitor.slow_callbacks == 1
+    assert monitor.stalls == 1
+    stacks = [w for w in warnings if 'loop thread stack' in w]
+    assert len(stacks) == 1
+    assert 'blocking_callback' in stacks[0] and 'time.sleep(0.3)' in stacks[0]
@@ -0,0 +1,53 @@
+import asyncio
+import contextvars
+from util.metrics import MetricsRegistry, merge_labelled, set_account_label
+
+def test_unlabelled_without_an_account():
+    registry = MetricsRegistry()
+    registry.counter('events_total', 'events', 'device_name').inc('Drive')
+    registry.histogram('latency_seconds', 'latency', (1.0,)).observe(0.5)
+    text = registry.render()
+    assert 'events_total{device_name="Drive"} 1' in text
+    assert 'latency_seconds_bucket{le="1.0"} 1' in text
+    assert 'latency_seconds_count 1' in text
+
+def test_accounts_as_tasks_are_labelled_apart():
+    registry = MetricsRegistry()
+    counter = registry.counter('events_total', 'events', 'device_name')
+    histogram = registry.histogram('latency_seconds', 'latency', (1.0,))
+
+    async def account(name: str, events: int) -> None:
+        registry.gauge('time_to_listen_seconds', 'time to listen', lambda: events)
+        # a task started by the account's task carries its label too
+        async def child():
+            for _ in range(events):
+                counter.inc('Drive')
+                histogram.observe(2.0)
+        await asyncio.create_task(child())
+
+    async def run():
+        tasks = []
+        for name, events in (('home', 2), ('farm', 3)):
+            context = contextvars.copy_context()
+            context.run(set_account_label, name)
+            tasks.append(context.run(asyncio.create_task, account(name, events)))
+        await asyncio.gather(*tasks)
+    asyncio.run(run())
+
+    text = registry.render()
+    assert 'events_total{account="home",device_name="Drive"} 2' in text
+    assert 'events_total{account="farm",device_name="Drive"} 3' in text
+    assert 'latency_seconds_bucket{account="farm",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{account="home"} 2' in text
+    assert 'time_to_listen_seconds{account="home"} 2' in text
+    assert 'time_to_listen_seconds{account="farm"} 3' in text
+
+def test_merge_labelled_keeps_families_together():
+    a = MetricsRegistry()
+    a.counter('events_total', 'events').inc()
+    b = MetricsRegistry()
+    b.counter('events_total', 'events').inc(amount=2)
+    text = merge_labelled({'home': a.render(), 'farm': b.render()}, 'account')
+    assert text.count('# TYPE events_total counter') == 1
+    assert 'events_total{account="home"} 1' in text
+    assert 'events_total{account="farm"} 2' in text
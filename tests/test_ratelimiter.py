@@ -0,0 +1,42 @@
+import asyncio
+import time
+from ring.fakering import FakeRing
+from ring.ratelimiter import get_rate_limiter
+
+def test_reconfigure_keeps_backoff():
+    ring = FakeRing({1: 'Drive'})
+    limiter = get_rate_limiter(ring, 2.0, 5)
+    limiter._on_throttled(429)
+    assert limiter.rate == 1.0
+
+    # the same config applied again, e.g. on a hot reload, mustn't undo the backoff
+    get_rate_limiter(ring, 2.0, 5)
+    assert limiter.rate == 1.0
+    assert limiter.base_rate == 2.0
+
+    # and it recovers towards a raised base on its own
+    get_rate_limiter(ring, 4.0, 5)
+    assert limiter.rate == 1.0
+    for _ in range(100):
+        limiter._on_success()
+    assert limiter.rate == 4.0
+
+def test_lower_base_rate_applies_straight_away():
+    ring = FakeRing({1: 'Drive'})
+    limiter = get_rate_limiter(ring, 2.0, 5)
+    get_rate_limiter(ring, 0.5, 5)
+    assert limiter.rate == 0.5
+
+def test_timed_call_excludes_queue_wait():
+    async def run():
+        limiter = get_rate_limiter(FakeRing({1: 'Drive'}), 10.0, 1)
+        async def api():
+            await asyncio.sleep(0.01)
+        await limiter.call(0, api)
+        # no tokens left, so this one queues for ~0.1s before the 0.01s call
+        start = time.monotonic()
+        _, duration, idle = await limiter.timed_call(0, api)
+        assert time.monotonic() - start >= 0.09
+        assert duration < 0.05
+        assert idle >= 0.08
+    asyncio.run(run())
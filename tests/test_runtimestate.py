@@ -0,0 +1,48 @@
+import asyncio
+import time
+from ring.fakering import FakeRing
+from ring.lightcontroller import LightController
+from ring.ringeventhandler import RingEventHandler
+from ring.runtimestate import load_state, restore_state, snapshot_state, write_state
+
+def make():
+    ring = FakeRing({1: 'Drive'}, latency=0.0, lag=0.0)
+    lc = LightController(ring, 'Drive', 'Europe/London')
+    return lc, RingEventHandler(ring, {1: lc})
+
+def test_round_trip(tmp_path):
+    async def run():
+        lc, handler = make()
+        handler.processed_events.add(42, time.time() + 100)
+        lc.restore_off(30, was_on=True)
+        write_state(tmp_path / 'state', snapshot_state(handler, {1: lc}))
+        lc.close()
+
+        lc, handler = make()
+        restore_state(load_state(tmp_path / 'state'), handler, {1: lc})
+        assert 42 in handler.processed_events
+        assert lc.snapshot()['on']
+        assert lc.off_pending
+        lc.close()
+    asyncio.run(run())
+
+def test_bad_entries_are_skipped():
+    async def run():
+        lc, handler = make()
+        now = time.time()
+        state = {
+            'events': [[1, now + 100], 'junk', [2], [3, 'soon']],
+            'lights': {'x': {'off_at': now + 10}, '1': {'on': True, 'off_at': 'later'}, '2': None},
+        }
+        restore_state(state, handler, {1: lc})
+        assert 1 in handler.processed_events
+        assert len(handler.processed_events) == 1
+        assert not lc.off_pending
+        # and a layout that isn't ours at all is ignored
+        restore_state({'events': {}, 'lights': []}, handler, {1: lc})
+        lc.close()
+    asyncio.run(run())
+
+def test_load_ignores_non_snapshot(tmp_path):
+    (tmp_path / 'state').write_text('[1, 2]', encoding='utf-8')
+    assert load_state(tmp_path / 'state') is None
@@ -0,0 +1,52 @@
+import time
+from util.ttlcache import TTLCache
+
+def test_expired_behind_a_hit_is_purged(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(time, 'time', lambda: now)
+    cache = TTLCache(100)
+    cache.add('a', now + 10)
+    cache.add('b', now + 100)
+    # a hit on 'a' mustn't hide it behind 'b' from the purge
+    assert 'a' in cache
+
+    now += 50
+    cache.add('c', now + 100)
+    assert cache.stats()['size'] == 2
+    assert cache.stats()['expired'] == 1
+
+def test_shorter_expiry_inserted_later_is_purged(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(time, 'time', lambda: now)
+    cache = TTLCache(100)
+    cache.add('long', now + 100)
+    cache.add('short', now + 10)
+
+    now += 50
+    cache.add('new', now + 100)
+    assert sorted(key for key, _ in cache.items()) == ['long', 'new']
+    assert len(cache) == 2
+
+def test_full_cache_evicts_least_recently_used(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(time, 'time', lambda: now)
+    cache = TTLCache(2)
+    cache.add('a', now + 100)
+    cache.add('b', now + 100)
+    # the hit makes 'b' the least recently used
+    assert 'a' in cache
+    cache.add('c', now + 100)
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert cache.stats()['evicted'] == 1
+
+def test_readd_keeps_newest_expiry(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(time, 'time', lambda: now)
+    cache = TTLCache(10)
+    cache.add('a', now + 10)
+    cache.add('a', now + 100)
+    now += 50
+    cache.add('b', now + 100)
+    assert 'a' in cache
+    assert cache.stats()['expired'] == 0